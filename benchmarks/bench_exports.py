@@ -0,0 +1,55 @@
+# Concurrent export loop against a local stand-in for the Earth Engine task service.
+#
+#   python benchmarks/bench_exports.py --durations 4 6 5 8 --fail-first 1
+#
+# Each job "runs" for its duration, reporting progress as it goes; --fail-first makes that
+# many jobs fail on their first attempt so only they are resubmitted. With every export
+# submitted up front, the batch takes about as long as the slowest export (plus one retry),
+# not the sum of them all.
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(
+    0,
+    os.environ.get(
+        "SCL_SRC_DIR",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"),
+    ),
+)
+
+import exports  # noqa: E402
+from parameters import SPECIES  # noqa: E402
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--durations", type=float, nargs="+", default=[4, 6, 5, 8])
+    parser.add_argument("--fail-first", type=int, default=1)
+    parser.add_argument("--poll-seconds", type=float, default=0.25)
+    options = parser.parse_args()
+
+    names = [f"{s}/structural_habitat" for s in SPECIES][: len(options.durations)]
+    service = exports.LocalExportService(
+        dict(zip(names, options.durations)), names[: options.fail_first]
+    )
+    jobs = [exports.ExportJob(name, service.submitter(name)) for name in names]
+    start = time.perf_counter()
+    exports.export_all(
+        jobs,
+        service.status,
+        poll_seconds=options.poll_seconds,
+        max_poll_seconds=options.poll_seconds * 4,
+    )
+    print(
+        json.dumps(
+            {
+                "exports": len(jobs),
+                "seconds": round(time.perf_counter() - start, 2),
+                "slowest_export_seconds": max(options.durations),
+                "sum_export_seconds": sum(options.durations),
+            },
+            indent=2,
+        )
+    )
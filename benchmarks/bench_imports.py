@@ -0,0 +1,93 @@
+# Start-up cost of the task entry points, for the many short validation and preview jobs.
+#
+#   python benchmarks/bench_imports.py --repeat 5 --output imports.json
+#
+# Each command runs in a fresh interpreter; the best wall time of --repeat runs is reported
+# together with the cumulative import time Python's -X importtime attributes to the top-level
+# modules it loaded.
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+SRC_DIR = os.environ.get(
+    "SCL_SRC_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"),
+)
+COMMANDS = {
+    "cli --help": ["cli.py", "--help"],
+    "task --help": ["task.py", "--help"],
+    "import parameters": ["-c", "import parameters"],
+    "import task": ["-c", "import task"],
+    "species parameters": [
+        "-c",
+        "import parameters; parameters.HEIGHT['Panthera_tigris']",
+    ],
+    "numpy engine modules": [
+        "-c",
+        "import task, tiling, manifest, zone_raster, input_cache",
+    ],
+    "ee engine modules": ["-c", "import task, ee, exports"],
+}
+
+
+def top_level_imports(stderr):
+    # -X importtime lines: "import time: self [us] | cumulative | imported package"
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not name.startswith(" ") or name.startswith("  "):
+            continue
+        try:
+            modules[name.strip()] = int(cumulative) / 1e6
+        except ValueError:
+            pass
+    return modules
+
+
+def bench_command(args, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", *args],
+            cwd=SRC_DIR,
+            capture_output=True,
+            text=True,
+        )
+        seconds = time.perf_counter() - start
+        if best is None or seconds < best[0]:
+            best = (seconds, result)
+    seconds, result = best
+    modules = top_level_imports(result.stderr)
+    return {
+        "seconds": round(seconds, 4),
+        "returncode": result.returncode,
+        "slowest_imports": {
+            name: round(t, 4)
+            for name, t in sorted(modules.items(), key=lambda m: -m[1])[:5]
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--commands", nargs="+", choices=list(COMMANDS))
+    parser.add_argument("--output", help="write results JSON here instead of stdout")
+    options = parser.parse_args()
+
+    results = {
+        name: bench_command(COMMANDS[name], options.repeat)
+        for name in options.commands or COMMANDS
+    }
+    report = json.dumps(results, indent=2)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
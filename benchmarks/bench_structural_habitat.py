@@ -0,0 +1,251 @@
+# Stage timings for the local structural habitat computation on synthetic rasters.
+#
+#   python benchmarks/bench_structural_habitat.py --sizes 1000 4000 --output bench.json
+#
+# Synthetic land cover, elevation, zone and 30 m forest height tiles are generated per window
+# (so 40000 x 40000 runs need no inputs on disk) and pushed through the stage functions of
+# numpy_engine.structural_habitat, timed separately: forest height aggregation, per-zone reclass
+# (land cover to elevation ceiling remap) and elevation comparison, zone mosaic, height gating
+# and write. The fused reclass kernel the tiled engine runs is timed on the same tiles as its own
+# stage. --allocations also reports the peak bytes the kernel and the staged engine allocate per
+# tile (tracemalloc, first tile excluded).
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+import numpy as np
+
+sys.path.insert(
+    0,
+    os.environ.get(
+        "SCL_SRC_DIR",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"),
+    ),
+)
+
+import numpy_engine  # noqa: E402
+import raster_io  # noqa: E402
+import reclass_kernel  # noqa: E402
+from lookup import load_lookup  # noqa: E402
+from parameters import FOREST_HEIGHT_SCALE, HEIGHT, SPECIES  # noqa: E402
+from tiling import DEFAULT_TILE_SIZE, tile_windows  # noqa: E402
+
+SCALE = 300
+BLOCK = SCALE // FOREST_HEIGHT_SCALE
+STAGES = [
+    "forest_height",
+    "reclass",
+    "elevation_comparison",
+    "zone_mosaic",
+    "height_allowed",
+    "write",
+]
+# the tiled engine's path: all of the above but the write in one call
+KERNEL_STAGE = "reclass_kernel"
+TILE_INPUTS = ["land_cover_esa", "elevation", "zones", "forest_height", "watermask"]
+
+
+def synthetic_tile(reclass_lookup, window, block, seed=0):
+    rng = np.random.default_rng([seed, window.row_off, window.col_off])
+    shape = (window.height, window.width)
+    lc_values = np.flatnonzero(
+        reclass_lookup.include_class | reclass_lookup.include_height
+    )
+    lc_values = lc_values[lc_values < 256]
+    zones = rng.integers(0, len(reclass_lookup.zone_numbers) + 1, size=shape)
+    forest_height = rng.uniform(0, 30, size=(shape[0] * block, shape[1] * block))
+    forest_height[rng.random(forest_height.shape) < 0.02] = np.nan
+    return {
+        "land_cover_esa": rng.choice(lc_values, size=shape).astype(np.uint8),
+        "elevation": rng.integers(-100, 6000, size=shape).astype(np.int16),
+        "zones": zones.astype(np.uint8),
+        "forest_height": forest_height.astype(np.float32),
+        "watermask": (rng.random(forest_height.shape) > 0.05).astype(np.uint8),
+    }
+
+
+def timed(timings, stage, fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    timings[stage] += time.perf_counter() - start
+    return result
+
+
+def allocated(fn, *args):
+    # fn(*args) and the peak bytes it allocated, when tracemalloc is tracing
+    if not tracemalloc.is_tracing():
+        return fn(*args), 0
+    before = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    result = fn(*args)
+    return result, tracemalloc.get_traced_memory()[1] - before
+
+
+def bench_species(species, size, tile_size, sink=None, seed=0, allocations=False):
+    height = HEIGHT[species]
+    reclass_lookup = load_lookup(species)
+    thresholds = reclass_lookup.thresholds()
+    kernel = reclass_kernel.ReclassKernel(species, BLOCK)
+    # compile (numba) and size the kernel's buffers outside the timings
+    warmup = synthetic_tile(reclass_lookup, raster_io.Window(0, 0, 8, 8), BLOCK, seed)
+    kernel(*[warmup[name] for name in TILE_INPUTS])
+    allocated_bytes = {"staged": [], "fused": []}
+    timings = defaultdict(float)
+    pixels = 0
+
+    for window in tile_windows(raster_io.Window(0, 0, size, size), tile_size):
+        tile = synthetic_tile(reclass_lookup, window, BLOCK, seed)
+        pixels += window.height * window.width
+
+        forest_mask = None
+        if height["INCLUDE"]:
+            forest_mask = timed(
+                timings,
+                "forest_height",
+                numpy_engine.forest_height_mask,
+                tile["forest_height"],
+                height["HEIGHT_THRESHOLD"],
+                height["HEIGHT_COVER_THRESHOLD"],
+                BLOCK,
+                tile["watermask"],
+            )
+
+        str_hab = np.zeros(tile["zones"].shape, dtype=bool)
+        for zone in reclass_lookup.zone_numbers:
+            zone_mask = timed(timings, "zone_mosaic", np.equal, tile["zones"], zone)
+            ceiling = timed(
+                timings,
+                "reclass",
+                numpy_engine.remap,
+                tile["land_cover_esa"],
+                thresholds[zone],
+            )
+            habitat = timed(
+                timings,
+                "elevation_comparison",
+                lambda: (tile["elevation"] <= ceiling) & zone_mask,
+            )
+            timed(timings, "zone_mosaic", np.logical_or, str_hab, habitat, out=str_hab)
+        allowed = timed(
+            timings,
+            "height_allowed",
+            numpy_engine.height_allowed,
+            tile["land_cover_esa"],
+            reclass_lookup.requires_height,
+            forest_mask,
+        )
+        str_hab &= allowed
+
+        if sink is not None:
+            timed(timings, "write", sink.write, window, str_hab.astype(np.uint8))
+
+        arguments = [tile[name] for name in TILE_INPUTS]
+        timed(timings, KERNEL_STAGE, kernel, *arguments)
+        if allocations:
+            allocated_bytes["fused"].append(allocated(kernel, *arguments)[1])
+            allocated_bytes["staged"].append(
+                allocated(
+                    lambda *a: numpy_engine.structural_habitat(
+                        species, *a, block=BLOCK
+                    ),
+                    *arguments,
+                )[1]
+            )
+
+    staged = sum(timings[stage] for stage in STAGES)
+    fused = timings[KERNEL_STAGE] + timings["write"]
+    return {
+        "species": species,
+        "size": size,
+        "pixels": pixels,
+        "stages": {
+            stage: {
+                "seconds": round(timings[stage], 4),
+                "pixels_per_sec": (
+                    round(pixels / timings[stage]) if timings[stage] else None
+                ),
+            }
+            for stage in STAGES + [KERNEL_STAGE]
+        },
+        "staged_seconds": round(staged, 4),
+        "staged_pixels_per_sec": round(pixels / staged) if staged else None,
+        "kernel_seconds": round(fused, 4),
+        "kernel_pixels_per_sec": round(pixels / fused) if fused else None,
+        "allocated_bytes_per_tile": (
+            {
+                approach: round(np.mean(sizes[1:]))
+                for approach, sizes in allocated_bytes.items()
+            }
+            if allocations and len(allocated_bytes["fused"]) > 1
+            else None
+        ),
+        "fused_jit": kernel.jit,
+        "peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+        ),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1000],
+        help="output raster side lengths in 300 m pixels (forest height is 10x finer)",
+    )
+    parser.add_argument("-s", "--species", nargs="+", default=SPECIES)
+    parser.add_argument("--tile-size", type=int, default=DEFAULT_TILE_SIZE)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--no-write", action="store_true", help="skip the output write stage"
+    )
+    parser.add_argument(
+        "--allocations",
+        action="store_true",
+        help="trace allocations to report bytes allocated per tile (slower)",
+    )
+    parser.add_argument("--output", help="write results JSON here instead of stdout")
+    options = parser.parse_args()
+    if options.allocations:
+        tracemalloc.start()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for size in options.sizes:
+            for species in options.species:
+                sink = None
+                if not options.no_write:
+                    sink = raster_io.RasterSink(
+                        os.path.join(tmpdir, f"{species}_{size}.npy"),
+                        (size, size),
+                        np.uint8,
+                    )
+                try:
+                    results.append(
+                        bench_species(
+                            species,
+                            size,
+                            options.tile_size,
+                            sink,
+                            options.seed,
+                            options.allocations,
+                        )
+                    )
+                finally:
+                    if sink is not None:
+                        sink.close()
+                        os.remove(sink.path)
+
+    report = json.dumps(results, indent=2)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
@@ -0,0 +1,188 @@
+import json
+import os
+import numpy as np
+from raster_io import grid_profile
+
+BITMASK_ARRAY = "mask.npy"
+BITMASK_INDEX = "index.json"
+BITORDER = "little"
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+# str_hab is binary, so locally it can be stored as packed bits: a <name>.bits directory holding
+# mask.npy, a (2, rows, ceil(cols / 8)) uint8 array of the habitat bits (plane 0) and a
+# validity bitmap (plane 1), both packed along rows in little bit order, and index.json with
+# the shape and georeferencing. Habitat bits are only ever set where the pixel is valid, so
+# consumers can memory-map mask.npy and AND / OR / popcount the packed bytes directly.
+
+
+def popcount(packed):
+    if hasattr(np, "bitwise_count"):
+        return int(np.bitwise_count(packed).sum(dtype=np.int64))
+    return int(POPCOUNT[packed].sum(dtype=np.int64))
+
+
+def pack(array):
+    return np.packbits(np.asarray(array, dtype=bool), axis=-1, bitorder=BITORDER)
+
+
+def unpack(packed, width):
+    return np.unpackbits(packed, axis=-1, count=width, bitorder=BITORDER)
+
+
+class PackedMask:
+    def __init__(self, bits, valid, width, profile=None):
+        self.bits = bits
+        self.valid = valid
+        self.shape = (bits.shape[0], width)
+        self.profile = profile
+
+    @classmethod
+    def from_array(cls, array, valid=None, profile=None):
+        valid = np.ones(array.shape, dtype=bool) if valid is None else valid
+        return cls(
+            pack(np.asarray(array) & valid), pack(valid), array.shape[1], profile
+        )
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        with open(os.path.join(path, BITMASK_INDEX)) as f:
+            index = json.load(f)
+        planes = np.load(os.path.join(path, BITMASK_ARRAY), mmap_mode=mmap_mode)
+        return cls(planes[0], planes[1], index["shape"][1], grid_profile(index))
+
+    def save(self, path):
+        with BitMaskSink(path, self.shape, self.profile) as sink:
+            sink.planes[0] = self.bits
+            sink.planes[1] = self.valid
+        return path
+
+    def to_array(self):
+        return unpack(self.bits, self.shape[1])
+
+    def valid_mask(self):
+        return unpack(self.valid, self.shape[1]).astype(bool)
+
+    def _check(self, other):
+        if self.shape != other.shape:
+            raise ValueError(f"mask shapes differ: {self.shape} and {other.shape}")
+
+    def __and__(self, other):
+        # habitat in both; valid only where both are
+        self._check(other)
+        return PackedMask(
+            self.bits & other.bits,
+            self.valid & other.valid,
+            self.shape[1],
+            self.profile,
+        )
+
+    def __or__(self, other):
+        # habitat in either; valid where either is
+        self._check(other)
+        return PackedMask(
+            self.bits | other.bits,
+            self.valid | other.valid,
+            self.shape[1],
+            self.profile,
+        )
+
+    def count(self):
+        return popcount(self.bits)
+
+    def count_valid(self):
+        return popcount(self.valid)
+
+
+def _window_bytes(window):
+    # byte columns covering window, and the window's bit offset into the first of them
+    first = window.col_off // 8
+    last = -(-(window.col_off + window.width) // 8)
+    return slice(first, last), window.col_off - first * 8
+
+
+class BitMaskSource:
+    # reads windows of a .bits mask back as uint8 0 / 1, invalid pixels reading as 0
+    def __init__(self, path, image_id=None):
+        self.path = path
+        mask = PackedMask.load(path)
+        self._mask = mask
+        self.shape = mask.shape
+        self.dtype = np.dtype(np.uint8)
+        self.profile = mask.profile
+        if image_id is None:
+            stat = os.stat(os.path.join(path, BITMASK_ARRAY))
+            image_id = f"{os.path.abspath(path)}:{stat.st_mtime_ns}:{stat.st_size}"
+        self.image_id = image_id
+
+    def read(self, window=None):
+        if window is None:
+            return self._mask.to_array()
+        rows = slice(window.row_off, window.row_off + window.height)
+        columns, offset = _window_bytes(window)
+        bits = np.unpackbits(self._mask.bits[rows, columns], axis=-1, bitorder=BITORDER)
+        return bits[:, offset : offset + window.width]
+
+    def close(self):
+        self._mask = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class BitMaskSink:
+    # window-by-window writer; windows that are never written stay invalid
+    def __init__(self, path, shape, profile=None):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        profile = profile or {}
+        transform = profile.get("transform")
+        with open(os.path.join(path, BITMASK_INDEX), "w") as f:
+            json.dump(
+                {
+                    "shape": list(shape),
+                    "bitorder": BITORDER,
+                    "crs": str(profile["crs"]) if profile.get("crs") else None,
+                    "transform": list(transform)[:6] if transform else None,
+                },
+                f,
+            )
+        self.planes = np.lib.format.open_memmap(
+            os.path.join(path, BITMASK_ARRAY),
+            mode="w+",
+            dtype=np.uint8,
+            shape=(2, shape[0], -(-shape[1] // 8)),
+        )
+
+    def write(self, window, array, valid=None):
+        valid = np.ones(array.shape, dtype=bool) if valid is None else valid
+        rows = slice(window.row_off, window.row_off + window.height)
+        columns, offset = _window_bytes(window)
+        for plane, values in ((0, np.asarray(array) & valid), (1, valid)):
+            # unaligned window edges share bytes with their neighbours: merge, don't overwrite
+            packed = self.planes[plane, rows, columns]
+            bits = np.unpackbits(packed, axis=-1, bitorder=BITORDER)
+            bits[:, offset : offset + window.width] = values
+            self.planes[plane, rows, columns] = np.packbits(
+                bits, axis=-1, bitorder=BITORDER
+            )
+
+    def close(self):
+        self.planes.flush()
+        self.planes = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_bitmask(path):
+    return PackedMask.load(path)
+
+
+def write_bitmask(path, array, valid=None, profile=None):
+    return PackedMask.from_array(array, valid, profile).save(path)
@@ -0,0 +1,202 @@
+import argparse
+from lazy_import import lazy_import
+from parameters import (
+    DEFAULT_EXPORT_RETRIES,
+    DEFAULT_INPUT_CACHE_MB,
+    DEFAULT_METADATA_TTL,
+    DEFAULT_TILE_SIZE,
+    ENGINES,
+    SPECIES,
+)
+
+# The command line is parsed before the task module (task_base, ee, numpy) is imported, so
+# --help and argument errors come back without loading any backend.
+ee_cassette = lazy_import("ee_cassette")
+exports = lazy_import("exports")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--taskdate")
+    parser.add_argument(
+        "-s", "--species", help="species, or a comma-separated list of species to batch"
+    )
+    parser.add_argument(
+        "--all-species",
+        action="store_true",
+        help="batch every species; the numpy engine reads each input tile once for all",
+    )
+    parser.add_argument(
+        "--scenario", help="scenario, or a comma-separated list of scenarios to batch"
+    )
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default="ee",
+        help="compute backend: Earth Engine, or local numpy arrays read from --input-dir",
+    )
+    parser.add_argument(
+        "--input-dir",
+        help="directory of land_cover_esa, elevation, zones, forest_height and optional "
+        "watermask rasters (.tif or .npy) for the numpy engine",
+    )
+    parser.add_argument(
+        "--output-dir", help="directory the numpy engine writes structural_habitat to"
+    )
+    parser.add_argument(
+        "--previous-output-dir",
+        help="--output-dir of an earlier numpy engine run; tiles whose inputs are unchanged "
+        "since then are copied from it instead of recomputed",
+    )
+    parser.add_argument(
+        "--input-cache-mb",
+        type=int,
+        help="size cap of the local cache of inputs the numpy engine fetches from Earth "
+        f"Engine when --input-dir lacks them (default {DEFAULT_INPUT_CACHE_MB})",
+    )
+    parser.add_argument(
+        "--metadata-ttl",
+        type=int,
+        help="seconds the Earth Engine image ids, dates and zone lists resolved at startup "
+        f"are cached for; 0 disables the cache (default {DEFAULT_METADATA_TTL})",
+    )
+    parser.add_argument(
+        "--tile-size",
+        type=int,
+        help="output pixels per side of the windows the numpy engine streams; bounds peak "
+        f"memory (default {DEFAULT_TILE_SIZE})",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="processes the numpy engine spreads tiles across (default 1)",
+    )
+    parser.add_argument(
+        "--single-pass",
+        action="store_true",
+        help="evaluate all zones with one zone/land cover keyed remap instead of one "
+        "masked image per zone",
+    )
+    parser.add_argument(
+        "--lazy",
+        action="store_true",
+        help="numpy engine: evaluate through a lazy operation graph that merges duplicate "
+        "operations and reuses buffers along elementwise chains, in blocks of rows",
+    )
+    parser.add_argument(
+        "--explain",
+        action="store_true",
+        help="print the operation graph each species' calc builds, with duplicates merged "
+        "and in-place chains marked, instead of computing it",
+    )
+    parser.add_argument(
+        "--bit-packed",
+        action="store_true",
+        help="write numpy engine output as a .bits mask: 1 bit per pixel plus a validity "
+        "bitmap, memory-mappable for bitwise AND/OR/popcount",
+    )
+    parser.add_argument(
+        "--sweep",
+        help="numpy engine: evaluate a grid of parameter values in one pass and write a "
+        "habitat area table per scenario, e.g. 'height_threshold=3,5,7 "
+        "height_cover_threshold=50,75 elev_offset=-250,0,250' (elev_offset is metres added "
+        "to every elevation ceiling)",
+    )
+    parser.add_argument(
+        "--preview",
+        "--dry-run",
+        action="store_true",
+        help="evaluate a small sample and report graph size and estimated cost instead "
+        "of exporting",
+    )
+    parser.add_argument(
+        "--profile",
+        help="write a JSON run report of per-stage wall time, pixels, bytes read and "
+        "memory high-water mark to this path",
+    )
+    parser.add_argument(
+        "--prometheus-textfile",
+        help="write the run report as a Prometheus node_exporter textfile to this path",
+    )
+    parser.add_argument(
+        "--export-splits",
+        type=int,
+        help="split the ee export into this many longitude strips exported concurrently "
+        "(default 1)",
+    )
+    parser.add_argument(
+        "--export-retries",
+        type=int,
+        help="times a failed ee export (or strip) is resubmitted "
+        f"(default {DEFAULT_EXPORT_RETRIES})",
+    )
+    parser.add_argument(
+        "--cassette",
+        help="directory to record the task's Earth Engine calls into, or replay them from "
+        "without contacting Earth Engine",
+    )
+    parser.add_argument(
+        "--cassette-mode",
+        choices=("record", "replay"),
+        help="default: replay when --cassette holds a recording, else record",
+    )
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="overwrite existing outputs instead of incrementing",
+    )
+    return parser
+
+
+def main(task_class=None, argv=None):
+    parser = build_parser()
+    options = vars(parser.parse_args(argv))
+    if options["sweep"] and options["engine"] != "numpy":
+        parser.error("--sweep needs --engine numpy")
+    cassette = None
+    cassette_path, cassette_mode = options.pop("cassette"), options.pop("cassette_mode")
+    if cassette_path:
+        # before the task module is imported, so that its ee (and task_base's) is the proxy
+        cassette = ee_cassette.install(cassette_path, cassette_mode)
+    try:
+        run(task_class, options)
+    finally:
+        if cassette is not None:
+            cassette.close()
+
+
+def run(task_class, options):
+    if task_class is None:
+        from task import SCLStructruralHabitat as task_class
+    batch_species = list(SPECIES) if options.pop("all_species") else None
+    if options["species"] and "," in options["species"]:
+        batch_species = options["species"].split(",")
+    scenarios = (options.pop("scenario") or "").split(",")
+
+    if options["engine"] == "numpy":
+        if batch_species:
+            options.update(species=batch_species[0], batch_species=batch_species)
+        for scenario in scenarios:
+            task_class(**options, scenario=scenario or None).run()
+    else:
+        # every species / scenario is built first, then all exports run concurrently
+        tasks = [
+            task_class(
+                **{**options, "species": species},
+                scenario=scenario or None,
+                defer_exports=True,
+            )
+            for species in batch_species or [options["species"]]
+            for scenario in scenarios
+        ]
+        for task in tasks:
+            task.run()
+        exports.export_all(
+            [job for task in tasks for job in task.export_jobs],
+            task_class.ee_export_status,
+            **tasks[0].export_options(),
+        )
+
+
+if __name__ == "__main__":
+    main()
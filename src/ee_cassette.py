@@ -0,0 +1,271 @@
+import base64
+import hashlib
+import json
+import os
+import sys
+import threading
+
+RECORD = "record"
+REPLAY = "replay"
+CASSETTE_MODES = (RECORD, REPLAY)
+INTERACTIONS_FILE = "interactions.json"
+BLOB_DIR = "blobs"
+# calls whose results come from the service (or need the real client library); every ee.data
+# and ee.serializer function is one too
+SERVICE_CALLS = (
+    "Initialize",
+    "Authenticate",
+    "getInfo",
+    "getThumbURL",
+    "getDownloadURL",
+    "start",
+)
+SERVICE_MODULES = ("ee.data.", "ee.serializer.")
+CALL_PREVIEW_CHARS = 300
+
+# Record/replay for the Earth Engine client. install() puts a proxy in place of the ee module
+# (in sys.modules and in every loaded module that imported it): building images and collections
+# only records the expression, and the calls that reach the service (getInfo, ee.data.*, export
+# start, ...) are keyed on the expression they evaluate. Recording runs each call for real and
+# stores its result in a cassette directory; replaying answers the same calls from it, in the
+# order they were recorded, without credentials, network or the task queue. A call the cassette
+# does not hold raises CassetteMiss.
+
+_cassette = None
+
+
+class CassetteMiss(LookupError):
+    pass
+
+
+class EEException(Exception):
+    # stands in for ee.EEException when replaying without the client library installed
+    pass
+
+
+def replaying():
+    return _cassette is not None and _cassette.mode == REPLAY
+
+
+def _describe(value):
+    # deterministic text of an argument, proxies by the expression they stand for
+    if isinstance(value, Proxy):
+        return value._path
+    if isinstance(value, dict):
+        items = sorted(value.items(), key=lambda item: repr(item[0]))
+        return (
+            "{" + ", ".join(f"{_describe(k)}: {_describe(v)}" for k, v in items) + "}"
+        )
+    if isinstance(value, (list, tuple)):
+        return "[" + ", ".join(_describe(v) for v in value) + "]"
+    if callable(value):
+        return f"<{getattr(value, '__qualname__', type(value).__name__)}>"
+    return repr(value)
+
+
+def _arguments(args, kwargs):
+    return ", ".join(
+        [_describe(arg) for arg in args]
+        + [f"{name}={_describe(kwargs[name])}" for name in sorted(kwargs)]
+    )
+
+
+def _unwrap(value):
+    if isinstance(value, Proxy):
+        return value._target
+    if isinstance(value, dict):
+        return {k: _unwrap(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_unwrap(v) for v in value)
+    return value
+
+
+def _is_data(value):
+    if isinstance(value, (list, tuple)):
+        return all(_is_data(v) for v in value)
+    if isinstance(value, dict):
+        return all(_is_data(v) for v in value.values())
+    return value is None or isinstance(value, (str, int, float, bool))
+
+
+class Proxy:
+    __slots__ = ("_path", "_target", "_cassette")
+
+    def __init__(self, path, target, cassette):
+        self._path = path
+        self._target = target
+        self._cassette = cassette
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        path = f"{self._path}.{name}"
+        if path == "ee.EEException":
+            return self._cassette.exception
+        return self._cassette.attribute(path, self._target, name)
+
+    def __call__(self, *args, **kwargs):
+        path = f"{self._path}({_arguments(args, kwargs)})"
+        name = self._path.rsplit(".", 1)[-1]
+        if name in SERVICE_CALLS or self._path.startswith(SERVICE_MODULES):
+            return self._cassette.call(
+                path, lambda: self._target(*_unwrap(args), **_unwrap(kwargs))
+            )
+        target = None
+        if self._cassette.mode == RECORD:
+            target = self._target(*_unwrap(args), **_unwrap(kwargs))
+        return Proxy(path, target, self._cassette)
+
+    def __repr__(self):
+        return f"<ee proxy {self._path[:CALL_PREVIEW_CHARS]}>"
+
+
+class Cassette:
+    # a directory of recorded service responses: interactions.json in call order, and arrays
+    # (computePixels results) as .npy files under blobs/
+    def __init__(self, path, mode, ee_module=None):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(
+                f"cassette mode must be one of {CASSETTE_MODES}, not {mode}"
+            )
+        self.path = path
+        self.mode = mode
+        self.ee_module = ee_module
+        self.exception = getattr(ee_module, "EEException", EEException)
+        self.interactions = []
+        self.blobs = 0
+        self.responses = {}
+        self.played = {}
+        self.lock = threading.Lock()
+        if mode == REPLAY:
+            with open(os.path.join(path, INTERACTIONS_FILE)) as f:
+                self.interactions = json.load(f)["interactions"]
+            for interaction in self.interactions:
+                self.responses.setdefault(interaction["key"], []).append(interaction)
+        else:
+            os.makedirs(os.path.join(path, BLOB_DIR), exist_ok=True)
+
+    @staticmethod
+    def key(path):
+        return hashlib.sha256(path.encode()).hexdigest()[:32]
+
+    def _play(self, path):
+        key = self.key(path)
+        with self.lock:
+            responses = self.responses.get(key, [])
+            played = self.played.get(key, 0)
+            if played >= len(responses):
+                raise CassetteMiss(
+                    f"{self.path} has no recorded response for "
+                    f"{path[:CALL_PREVIEW_CHARS]} (call {played + 1})"
+                )
+            self.played[key] = played + 1
+        interaction = responses[played]
+        if "error" in interaction:
+            raise self.exception(interaction["error"])
+        return self._decode(interaction["response"])
+
+    def _record(self, path, **outcome):
+        with self.lock:
+            self.interactions.append(
+                {
+                    "key": self.key(path),
+                    "call": path[:CALL_PREVIEW_CHARS],
+                    **{k: self._encode(v) for k, v in outcome.items()},
+                }
+            )
+
+    def call(self, path, run):
+        if self.mode == REPLAY:
+            return self._play(path)
+        try:
+            response = run()
+        except self.exception as e:
+            self._record(path, error=str(e))
+            raise
+        self._record(path, response=response)
+        return response
+
+    def attribute(self, path, target, name):
+        # plain data attributes (an export task's id, say) are recorded like call results;
+        # everything else is proxied
+        if self.mode == REPLAY:
+            if self.key(path) in self.responses:
+                return self._play(path)
+            return Proxy(path, None, self)
+        value = getattr(target, name)
+        if _is_data(value):
+            self._record(path, response=value)
+            return value
+        return Proxy(path, value, self)
+
+    def _encode(self, value):
+        numpy = sys.modules.get("numpy")
+        if numpy is not None and isinstance(value, numpy.ndarray):
+            name = f"{self.blobs}.npy"
+            self.blobs += 1
+            numpy.save(os.path.join(self.path, BLOB_DIR, name), value)
+            return {"__ndarray__": name}
+        if isinstance(value, bytes):
+            return {"__bytes__": base64.b64encode(value).decode()}
+        if isinstance(value, dict):
+            return {k: self._encode(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self._encode(v) for v in value]
+        return value
+
+    def _decode(self, value):
+        if isinstance(value, dict):
+            if "__ndarray__" in value:
+                import numpy
+
+                return numpy.load(
+                    os.path.join(self.path, BLOB_DIR, value["__ndarray__"])
+                )
+            if "__bytes__" in value:
+                return base64.b64decode(value["__bytes__"])
+            return {k: self._decode(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self._decode(v) for v in value]
+        return value
+
+    def close(self):
+        if self.mode != RECORD:
+            return
+        path = os.path.join(self.path, INTERACTIONS_FILE)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"interactions": self.interactions}, f, indent=1)
+        os.replace(tmp_path, path)
+        print(f"recorded {len(self.interactions)} Earth Engine call(s) to {self.path}")
+
+
+def install(path, mode=None):
+    # route ee through a cassette; mode defaults to replay when path holds a recording
+    global _cassette
+    if mode is None:
+        recorded = os.path.exists(os.path.join(path, INTERACTIONS_FILE))
+        mode = REPLAY if recorded else RECORD
+    ee_module = previous = sys.modules.get("ee")
+    if isinstance(ee_module, Proxy):
+        ee_module = ee_module._cassette.ee_module
+    if ee_module is None:
+        try:
+            import ee as ee_module
+        except ImportError:
+            if mode == RECORD:
+                raise
+    cassette = Cassette(path, mode, ee_module)
+    proxy = Proxy("ee", ee_module, cassette)
+    for module in list(sys.modules.values()):
+        # read the namespace directly so that lazily imported modules are not loaded
+        try:
+            namespace = object.__getattribute__(module, "__dict__")
+        except AttributeError:
+            continue
+        bound = namespace.get("ee")
+        if bound is not None and (bound is ee_module or bound is previous):
+            namespace["ee"] = proxy
+    sys.modules["ee"] = proxy
+    _cassette = cassette
+    return cassette
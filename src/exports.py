@@ -0,0 +1,144 @@
+import asyncio
+import threading
+import time
+from typing import Callable, NamedTuple, Optional
+from parameters import DEFAULT_EXPORT_RETRIES
+
+DEFAULT_POLL_SECONDS = 10
+MAX_POLL_SECONDS = 120
+POLL_BACKOFF = 1.5
+COMPLETED_STATES = ("COMPLETED", "SUCCEEDED")
+FAILED_STATES = ("FAILED", "CANCELLED", "UNKNOWN")
+_submit_lock = threading.Lock()
+
+# Exports run concurrently: each job is submitted, then polled with exponential backoff until
+# it completes or fails, and a failed job is resubmitted on its own while the others carry on.
+# The export service is two blocking callables, job.submit() -> task id and
+# status(task id) -> (state, progress fraction or None, error message or None), run in worker
+# threads, so the same loop drives Earth Engine tasks or a local stand-in service.
+
+
+class ExportError(Exception):
+    pass
+
+
+class ExportJob(NamedTuple):
+    name: str
+    submit: Callable[[], str]
+    # called with the id of a failed attempt before it is resubmitted
+    discard: Optional[Callable[[str], None]] = None
+
+
+def submit_tracked(tasks, start):
+    # start() records the task it submits in the tasks dict without returning it (as
+    # export_image_ee does). Jobs submit from several threads at once, so each submission
+    # runs alone and its id is the one key it added.
+    with _submit_lock:
+        started = set(tasks)
+        start()
+        (task_id,) = set(tasks) - started
+    return task_id
+
+
+class LocalExportService:
+    # stand-in for the Earth Engine task service: a task runs for its job's duration, and
+    # the jobs in fail_first fail halfway through their first attempt
+    def __init__(self, durations, fail_first=(), submit_seconds=0):
+        self.durations = durations
+        self.fail_first = set(fail_first)
+        self.submit_seconds = submit_seconds
+        self.tasks = {}
+        self.lock = threading.Lock()
+
+    def start(self, name):
+        # records the task it starts in tasks, like export_image_ee
+        time.sleep(self.submit_seconds)
+        with self.lock:
+            task_id = f"{name}-{len(self.tasks)}"
+            fail = name in self.fail_first
+            self.fail_first.discard(name)
+            self.tasks[task_id] = (time.monotonic(), self.durations[name], fail)
+
+    def submitter(self, name):
+        return lambda: submit_tracked(self.tasks, lambda: self.start(name))
+
+    def status(self, task_id):
+        started, duration, fail = self.tasks[task_id]
+        fraction = (time.monotonic() - started) / duration
+        if fail and fraction >= 0.5:
+            return "FAILED", None, "stand-in failure"
+        if fraction >= 1:
+            return "COMPLETED", 1.0, None
+        return "RUNNING", round(fraction, 2), None
+
+
+class ExportProgress:
+    # latest (state, progress, attempt) per job, printed whenever one changes
+    def __init__(self, names, verbose=True):
+        self.states = {name: ("PENDING", None, 0) for name in names}
+        self.verbose = verbose
+        self.start = time.monotonic()
+
+    def __call__(self, name, state, progress, attempt):
+        if self.states[name] == (state, progress, attempt):
+            return
+        self.states[name] = (state, progress, attempt)
+        if self.verbose:
+            percent = "" if progress is None else f" {progress:.0%}"
+            retry = f" (attempt {attempt})" if attempt > 1 else ""
+            print(
+                f"[{time.monotonic() - self.start:7.1f}s] {self.completed}/"
+                f"{len(self.states)} exports done; {name} {state}{percent}{retry}"
+            )
+
+    @property
+    def completed(self):
+        return sum(state in COMPLETED_STATES for state, _, _ in self.states.values())
+
+
+async def _run_job(job, status, progress, poll_seconds, max_poll_seconds, retries):
+    for attempt in range(1, retries + 2):
+        task_id = await asyncio.to_thread(job.submit)
+        progress(job.name, "SUBMITTED", None, attempt)
+        interval = poll_seconds
+        while True:
+            await asyncio.sleep(interval)
+            state, fraction, error = await asyncio.to_thread(status, task_id)
+            progress(job.name, state, fraction, attempt)
+            if state in COMPLETED_STATES:
+                return task_id
+            if state in FAILED_STATES:
+                break
+            interval = min(interval * POLL_BACKOFF, max_poll_seconds)
+        if job.discard is not None:
+            job.discard(task_id)
+    raise ExportError(f"{job.name} failed after {retries + 1} attempt(s): {error}")
+
+
+async def run_exports(
+    jobs,
+    status,
+    progress=None,
+    poll_seconds=DEFAULT_POLL_SECONDS,
+    max_poll_seconds=MAX_POLL_SECONDS,
+    retries=DEFAULT_EXPORT_RETRIES,
+):
+    # returns {job name: task id of the attempt that completed}
+    progress = progress or ExportProgress([job.name for job in jobs])
+    results = await asyncio.gather(
+        *(
+            _run_job(job, status, progress, poll_seconds, max_poll_seconds, retries)
+            for job in jobs
+        ),
+        return_exceptions=True,
+    )
+    failures = [str(result) for result in results if isinstance(result, Exception)]
+    if failures:
+        raise ExportError("; ".join(failures))
+    return {job.name: task_id for job, task_id in zip(jobs, results)}
+
+
+def export_all(jobs, status, **kwargs):
+    if not jobs:
+        return {}
+    return asyncio.run(run_exports(jobs, status, **kwargs))
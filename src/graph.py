@@ -0,0 +1,413 @@
+import numpy as np
+
+DEFAULT_CHUNK_ROWS = 128
+ELEMENTWISE = (
+    "remap",
+    "lte",
+    "gte",
+    "gt",
+    "eq",
+    "And",
+    "Or",
+    "Not",
+    "unmask",
+    "toInt",
+    "multiply",
+    "add",
+    "updateMask",
+    "selfMask",
+    "reproject",
+)
+BOOLEAN_OPS = {
+    "lte": np.less_equal,
+    "gte": np.greater_equal,
+    "gt": np.greater,
+    "eq": np.equal,
+    "And": np.logical_and,
+    "Or": np.logical_or,
+}
+
+# A lazy mirror of the ee image graph calc() builds. Calling ee-style methods on a Node records
+# the operation instead of running it; recording an operation already in the graph (same op,
+# same inputs, same parameters) returns the existing node, so repeated remaps, forest height
+# chains and duplicate collection members are computed once. Evaluation plans the graph first:
+# along chains of elementwise operations whose intermediates feed nothing else, an operation
+# writes into its input's buffers when the dtypes allow, and the whole graph is run a block of
+# rows at a time. Values are (data, mask)
+# pairs as in ee, a None mask meaning every pixel is valid. describe() lists the operations the
+# ee backend would be asked to run.
+
+
+class Node:
+    __slots__ = ("graph", "id", "op", "args", "params", "fine")
+
+    def __init__(self, graph, node_id, op, args, params, fine):
+        self.graph = graph
+        self.id = node_id
+        self.op = op
+        self.args = args
+        self.params = params
+        # on the fine (forest height) grid, `block` pixels per output cell
+        self.fine = fine
+
+    def _binary(self, op, other):
+        if isinstance(other, Node):
+            return self.graph.node(op, (self, other))
+        return self.graph.node(op, (self,), (other,))
+
+    def remap(self, from_values, to_values, defaultValue=None):
+        return self.graph.node(
+            "remap", (self,), (tuple(from_values), tuple(to_values), defaultValue)
+        )
+
+    def lte(self, other):
+        return self._binary("lte", other)
+
+    def gte(self, other):
+        return self._binary("gte", other)
+
+    def gt(self, other):
+        return self._binary("gt", other)
+
+    def eq(self, other):
+        return self._binary("eq", other)
+
+    def And(self, other):
+        return self._binary("And", other)
+
+    def Or(self, other):
+        return self._binary("Or", other)
+
+    def Not(self):
+        return self.graph.node("Not", (self,))
+
+    def unmask(self, value=0):
+        return self.graph.node("unmask", (self,), (value,))
+
+    def toInt(self):
+        return self.graph.node("toInt", (self,))
+
+    def multiply(self, other):
+        return self._binary("multiply", other)
+
+    def add(self, other):
+        return self._binary("add", other)
+
+    def updateMask(self, mask):
+        return self.graph.node("updateMask", (self, mask))
+
+    def selfMask(self):
+        return self.graph.node("selfMask", (self,))
+
+    def reduceResolution(self, reducer="mean"):
+        return self.graph.node("reduceResolution", (self,), (reducer,))
+
+    def reproject(self, scale=None, crs=None):
+        return self.graph.node("reproject", (self,), (scale, crs))
+
+    def __repr__(self):
+        return f"%{self.id}"
+
+
+class ImageCollection:
+    def __init__(self, images):
+        self.images = list(images)
+
+    def max(self):
+        # max is idempotent, so duplicate members only need evaluating once
+        images = list(dict.fromkeys(self.images))
+        if len(images) == 1:
+            return images[0]
+        return images[0].graph.node("max", tuple(images))
+
+    def mosaic(self):
+        # later images are on top: of duplicates only the last one can show
+        images = list(reversed(list(dict.fromkeys(reversed(self.images)))))
+        if len(images) == 1:
+            return images[0]
+        return images[0].graph.node("mosaic", tuple(images))
+
+
+class Graph:
+    def __init__(self):
+        self.nodes = []
+        self._index = {}
+        self.merged = 0
+
+    def node(self, op, args=(), params=()):
+        key = (op, tuple(arg.id for arg in args), params)
+        node = self._index.get(key)
+        if node is not None:
+            self.merged += 1
+            return node
+        fine = {arg.fine for arg in args}
+        if op == "reduceResolution":
+            fine = {False}
+        elif op == "source":
+            fine = {params[1]}
+        if len(fine) > 1:
+            raise ValueError(f"{op} mixes fine and output grid inputs {args}")
+        node = Node(self, len(self.nodes), op, args, params, fine.pop())
+        self.nodes.append(node)
+        self._index[key] = node
+        return node
+
+    def source(self, name, fine=False):
+        return self.node("source", (), (name, fine))
+
+    def plan(self, outputs):
+        return Plan(self, outputs)
+
+    def evaluate(self, outputs, arrays, block=10, chunk_rows=DEFAULT_CHUNK_ROWS):
+        return self.plan(outputs).evaluate(arrays, block, chunk_rows)
+
+    def describe(self, outputs):
+        return self.plan(outputs).describe()
+
+
+class Plan:
+    def __init__(self, graph, outputs):
+        self.graph = graph
+        self.outputs = list(outputs)
+        reachable = set()
+        stack = list(self.outputs)
+        while stack:
+            node = stack.pop()
+            if node.id not in reachable:
+                reachable.add(node.id)
+                stack.extend(node.args)
+        # node ids are assigned as nodes are recorded, so id order is a topological order
+        self.order = [node for node in graph.nodes if node.id in reachable]
+        self.consumers = {node.id: 0 for node in self.order}
+        for node in self.order:
+            for arg in node.args:
+                self.consumers[arg.id] += 1
+        output_ids = {node.id for node in self.outputs}
+        # a node is chained into the elementwise op consuming it when it feeds nothing else, so
+        # that op may overwrite its buffers instead of allocating new ones
+        self.chained = {
+            node.args[0].id
+            for node in self.order
+            if node.op in ELEMENTWISE
+            and node.args
+            and node.args[0].op in ELEMENTWISE
+            and self.consumers[node.args[0].id] == 1
+            and node.args[0].id not in output_ids
+        }
+        self._tables = {}
+
+    def chains(self):
+        # chains as lists of nodes, first to last
+        chained_into = {node.args[0].id: node for node in self.order if node.args}
+        chains = []
+        for node in self.order:
+            if node.id in self.chained and not (
+                node.args and node.args[0].id in self.chained
+            ):
+                chain = [node]
+                while chain[-1].id in self.chained:
+                    chain.append(chained_into[chain[-1].id])
+                chains.append(chain)
+        return chains
+
+    def _table(self, node):
+        # dense lookup table for a remap, the default (nan if none) where a value is not
+        # remapped
+        if node.id not in self._tables:
+            from_values, to_values, default = node.params
+            size = max(from_values, default=-1) + 1
+            table = np.full(size, np.nan if default is None else default)
+            table[list(from_values)] = to_values
+            self._tables[node.id] = table
+        return self._tables[node.id]
+
+    def _run(self, node, args, chunk, block):
+        # args are (data, data_free, mask, mask_free) values; a buffer is free when no other
+        # value shares it, and a free buffer of a chained first argument may be overwritten
+        op = node.op
+        if op == "source":
+            data = chunk[node.params[0]]
+            if np.issubdtype(data.dtype, np.floating):
+                return data, False, ~np.isnan(data), True
+            return data, False, None, False
+        data, data_free, mask, mask_free = args[0]
+        if node.args[0].id not in self.chained:
+            data_free = mask_free = False
+        other, other_mask = None, None
+        if len(args) > 1:
+            other, _, other_mask, _ = args[1]
+        elif node.params:
+            other = node.params[0]
+
+        if op == "remap":
+            table = self._table(node)
+            inside = (data >= 0) & (data < len(table))
+            values = table[np.where(inside, data, 0)]
+            default = node.params[2]
+            if default is not None:
+                return np.where(inside, values, default), True, mask, mask_free
+            return (values, True) + _and(mask, mask_free, inside & ~np.isnan(values))
+        out = data if data_free and data.dtype == bool else None
+        if op in BOOLEAN_OPS:
+            return (BOOLEAN_OPS[op](data, other, out=out), True) + _and(
+                mask, mask_free, other_mask, False
+            )
+        if op == "Not":
+            return np.logical_not(data, out=out), True, mask, mask_free
+        if op == "unmask":
+            if mask is None:
+                return data, data_free, None, False
+            return np.where(mask, data, other), True, None, False
+        if op == "toInt":
+            return data.astype(np.int32), True, mask, mask_free
+        if op in ("multiply", "add"):
+            ufunc = np.multiply if op == "multiply" else np.add
+            if data_free and np.result_type(data, other) == data.dtype:
+                data = ufunc(data, other, out=data)
+            else:
+                data = ufunc(data, other)
+            return (data, True) + _and(mask, mask_free, other_mask, False)
+        if op == "updateMask":
+            valid = other != 0
+            valid = _and(valid, True, other_mask, False)[0]
+            return (data, data_free) + _and(mask, mask_free, valid)
+        if op == "selfMask":
+            return (data, data_free) + _and(mask, mask_free, data != 0)
+        if op == "reproject":
+            return data, data_free, mask, mask_free
+        if op == "reduceResolution":
+            data, mask = _block_mean(data, mask, block)
+            return data, True, mask, True
+        if op in ("max", "mosaic"):
+            data, mask = _combine(op, [(arg[0], arg[2]) for arg in args])
+            return data, True, mask, True
+        raise ValueError(f"unknown operation {op}")
+
+    def _evaluate_chunk(self, chunk, block):
+        values = {}
+        remaining = dict(self.consumers)
+        keep = {node.id for node in self.outputs}
+        for node in self.order:
+            values[node.id] = self._run(
+                node, [values[arg.id] for arg in node.args], chunk, block
+            )
+            for arg in node.args:
+                remaining[arg.id] -= 1
+                if not remaining[arg.id] and arg.id not in keep:
+                    values.pop(arg.id, None)
+        return [values[node.id][::2] for node in self.outputs]
+
+    def evaluate(self, arrays, block=10, chunk_rows=DEFAULT_CHUNK_ROWS):
+        # [(data, mask)] per output over the output grid, computed chunk_rows rows at a time;
+        # arrays maps source names to arrays, fine sources `block` times finer
+        sources = {
+            node.params[0]: node.fine for node in self.order if node.op == "source"
+        }
+        rows = min(
+            len(arrays[name]) // block if fine else len(arrays[name])
+            for name, fine in sources.items()
+        )
+        results = None
+        for row_off in range(0, rows, chunk_rows):
+            row_end = min(row_off + chunk_rows, rows)
+            chunk = {
+                name: (
+                    arrays[name][row_off * block : row_end * block]
+                    if fine
+                    else arrays[name][row_off:row_end]
+                )
+                for name, fine in sources.items()
+            }
+            values = self._evaluate_chunk(chunk, block)
+            if results is None:
+                results = [
+                    (
+                        np.empty((rows,) + data.shape[1:], dtype=data.dtype),
+                        np.empty((rows,) + data.shape[1:], dtype=bool),
+                    )
+                    for data, _ in values
+                ]
+            for (data, mask), (out_data, out_mask) in zip(values, results):
+                out_data[row_off:row_end] = data
+                out_mask[row_off:row_end] = True if mask is None else mask
+        return results
+
+    def describe(self):
+        chain_of = {}
+        for i, chain in enumerate(self.chains()):
+            for node in chain:
+                chain_of[node.id] = i
+        output_ids = {node.id for node in self.outputs}
+        lines = [
+            f"{len(self.order)} operations, {self.graph.merged} duplicate operation(s) "
+            f"merged, {len(set(chain_of.values()))} in-place chain(s)"
+        ]
+        for node in self.order:
+            operands = [repr(arg) for arg in node.args] + _describe_params(node)
+            notes = []
+            if node.fine:
+                notes.append("fine grid")
+            if node.id in chain_of:
+                notes.append(f"chain {chain_of[node.id]}")
+            if node.id in output_ids:
+                notes.append("output")
+            note = f"  # {', '.join(notes)}" if notes else ""
+            lines.append(f"%{node.id} = {node.op}({', '.join(operands)}){note}")
+        return "\n".join(lines)
+
+
+def _describe_params(node):
+    if node.op == "source":
+        return [repr(node.params[0])]
+    if node.op == "remap":
+        default = node.params[2]
+        return [f"<{len(node.params[0])} values>"] + (
+            [] if default is None else [f"default={default!r}"]
+        )
+    return [repr(param) for param in node.params if param is not None]
+
+
+def _and(mask, mask_free, other, other_free=True):
+    # (combined validity, whether it is free); None is all valid, and free buffers are
+    # updated in place rather than copied
+    if other is None:
+        return mask, mask_free
+    if mask is None:
+        return other, other_free
+    if mask_free:
+        mask &= other
+        return mask, True
+    if other_free:
+        other &= mask
+        return other, True
+    return mask & other, True
+
+
+def _block_mean(data, mask, block):
+    # ee reduceResolution(mean) onto the output grid: mean of the valid pixels of each block,
+    # masked where a block has none
+    rows, cols = data.shape[0] // block, data.shape[1] // block
+    data = data[: rows * block, : cols * block]
+    valid = (
+        np.ones(data.shape, dtype=bool)
+        if mask is None
+        else mask[: rows * block, : cols * block]
+    )
+    total = np.where(valid, data, 0).reshape(rows, block, cols, block).sum(axis=(1, 3))
+    count = valid.reshape(rows, block, cols, block).sum(axis=(1, 3))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return total / count, count > 0
+
+
+def _combine(op, images):
+    # ImageCollection.max() / mosaic() of (data, mask) images
+    dtype = np.result_type(*(data for data, _ in images))
+    shape = images[0][0].shape
+    out_data = np.zeros(shape, dtype=dtype)
+    out_mask = np.zeros(shape, dtype=bool)
+    for data, mask in images:
+        valid = np.ones(shape, dtype=bool) if mask is None else mask
+        take = valid if op == "mosaic" else valid & (~out_mask | (data > out_data))
+        out_data[take] = data[take]
+        out_mask |= valid
+    return out_data, out_mask
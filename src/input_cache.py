@@ -0,0 +1,78 @@
+import json
+import os
+import numpy as np
+from keyed_cache import KeyedFileCache
+
+DEFAULT_INPUT_CACHE_BYTES = 20 * 2**30
+
+# Input rasters resampled onto a local grid, one memory-mappable .npy per entry; reads bump its
+# mtime and the least recently used entries are evicted past max_bytes.
+
+
+class InputCache(KeyedFileCache):
+    name = "inputs"
+    extension = ".npy"
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_INPUT_CACHE_BYTES):
+        super().__init__(cache_dir)
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(ee_path, image_id, scale, crs, grid=None, nodata=None):
+        return KeyedFileCache.key(
+            ee_path=ee_path,
+            image_id=image_id,
+            scale=scale,
+            crs=crs,
+            grid=grid,
+            nodata=nodata,
+        )
+
+    def get(self, key):
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        os.utime(path)
+        return path
+
+    def put(self, key, fields, shape, dtype, fill):
+        # fill(memmap) writes the pixels
+        def write(tmp_path):
+            array = np.lib.format.open_memmap(
+                tmp_path, mode="w+", dtype=dtype, shape=shape
+            )
+            try:
+                fill(array)
+                array.flush()
+            finally:
+                del array
+
+        path = self.write(self.path(key), write)
+        with open(os.path.join(self.cache_dir, f"{key}.json"), "w") as f:
+            json.dump(fields, f, sort_keys=True)
+        self.evict(keep=path)
+        return path
+
+    def entries(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npy"):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((stat.st_mtime, stat.st_size, name[: -len(".npy")]))
+        return sorted(entries)
+
+    def evict(self, keep=None):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            if self.path(key) == keep:
+                continue
+            for ext in (".npy", ".json"):
+                try:
+                    os.remove(os.path.join(self.cache_dir, f"{key}{ext}"))
+                except FileNotFoundError:
+                    pass
+            total -= size
+        return total
@@ -0,0 +1,58 @@
+import abc
+import hashlib
+import json
+import os
+import shutil
+from parameters import CACHE_DIR
+
+# Base of the on-disk caches: one file (or directory) per entry under CACHE_DIR/<name>, named
+# by a digest of the fields that determine it.
+
+
+class KeyedFileCache(abc.ABC):
+    name = None
+    extension = ""
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or os.path.join(CACHE_DIR, self.name)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(**fields):
+        digest = hashlib.sha256(
+            json.dumps(fields, sort_keys=True, default=str).encode()
+        )
+        return digest.hexdigest()[:24], fields
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f"{key}{self.extension}")
+
+    def write(self, path, write):
+        # write(tmp_path) creates the entry next to path; it is renamed into place once
+        # complete, so readers never see a partial one
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            write(tmp_path)
+        except BaseException:
+            if os.path.isdir(tmp_path):
+                shutil.rmtree(tmp_path, ignore_errors=True)
+            elif os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, path)
+        return path
+
+    @abc.abstractmethod
+    def get(self, key):
+        pass
+
+    @abc.abstractmethod
+    def put(self, key, fields, *args):
+        pass
+
+    def get_or_put(self, key, fields, *args):
+        # args are handed to put on a miss, so whatever fetches the entry only runs then
+        entry = self.get(key)
+        if entry is None:
+            entry = self.put(key, fields, *args)
+        return entry
@@ -0,0 +1,188 @@
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+from typing import NamedTuple
+import numpy as np
+from parameters import (
+    CACHE_DIR,
+    ELEV_ZONE_LABEL,
+    HEIGHT_TABLE,
+    LC_VALUE_LABEL,
+    INCLUDE_CLASS,
+    INCLUDE_HEIGHT,
+    SPECIES_FILES,
+    ZONE_KEY_MULTIPLIER,
+    species_definition,
+)
+from species_params import validate
+
+LOOKUP_VERSION = 3
+MIN_LC_SIZE = 256
+HEIGHT_FILE = "height.json"
+
+# Each species' parameters are validated and compiled once into a directory of .npy tables
+# (and its HEIGHT) keyed on a hash of the files defining them, which later runs (and every
+# worker) memory-map.
+
+_lookups = {}
+_heights = {}
+_hashes = {}
+
+
+class ReclassLookup(NamedTuple):
+    # dense tables indexed by lc_value; elev_threshold rows are zone numbers (row 0 unused)
+    include_class: np.ndarray
+    include_height: np.ndarray
+    elev_threshold: np.ndarray
+
+    @property
+    def zone_numbers(self):
+        return list(range(1, self.elev_threshold.shape[0]))
+
+    @property
+    def requires_height(self):
+        # per lc_value: habitat only where forest height cover is met
+        return self.include_class & self.include_height
+
+    def thresholds(self):
+        # elevation ceiling per (zone, lc_value), nan where the class is excluded; classes
+        # with and without forest height share it, the former gated by requires_height
+        return np.where(self.include_class, self.elev_threshold, np.nan)
+
+    def zone_tables(self):
+        # {zone: ([lc_value, ...], [elev ceiling, ...])} for remap-style consumers like ee
+        thresholds = self.thresholds()
+        tables = {}
+        for zone in self.zone_numbers:
+            lc_vals = np.flatnonzero(~np.isnan(thresholds[zone]))
+            tables[zone] = (
+                lc_vals.tolist(),
+                thresholds[zone, lc_vals].astype(int).tolist(),
+            )
+        return tables
+
+    def zone_keys(self):
+        # ([zone * ZONE_KEY_MULTIPLIER + lc_value, ...], [elev ceiling, ...]) for single-pass
+        # remaps over every zone
+        keys, ceilings = [], []
+        for zone, (lc_vals, elev_zone) in self.zone_tables().items():
+            for lc_val, ceiling in zip(lc_vals, elev_zone):
+                if lc_val >= ZONE_KEY_MULTIPLIER:
+                    raise ValueError(
+                        f"lc_value {lc_val} does not fit a zone lookup key"
+                    )
+                keys.append(zone * ZONE_KEY_MULTIPLIER + lc_val)
+                ceilings.append(ceiling)
+        return keys, ceilings
+
+    def height_allowed(self, land_cover, forest_mask):
+        # ee-style image (ee or graph) that is 1 where the class may be habitat: classes
+        # requiring forest height only where forest_mask() is set, never when it is None
+        requires_height = np.flatnonzero(self.requires_height).tolist()
+        if not requires_height:
+            return None
+        allowed = land_cover.remap(requires_height, [1] * len(requires_height), 0).Not()
+        if forest_mask is not None:
+            allowed = allowed.Or(forest_mask().unmask(0))
+        return allowed
+
+
+def parameter_sources(species):
+    # the files whose content defines the species' parameters
+    if species in SPECIES_FILES:
+        path = SPECIES_FILES[species]
+        if path.endswith((".yaml", ".yml")):
+            return [path]
+        return [path, os.path.join(os.path.dirname(path), HEIGHT_TABLE)]
+    return [importlib.util.find_spec(f"{species}_pars").origin]
+
+
+def _stat(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def parameter_hash(species):
+    # the files are only read again once one of them changes on disk
+    sources = parameter_sources(species)
+    key = (species, tuple((path, _stat(path)) for path in sources))
+    if key not in _hashes:
+        digest = hashlib.sha256(f"lookup-v{LOOKUP_VERSION}".encode())
+        for path in sources:
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    digest.update(f.read())
+        _hashes[key] = digest.hexdigest()[:16]
+    return _hashes[key]
+
+
+def compile_lookup(reclass_rows):
+    lc_size = max(MIN_LC_SIZE, max(r[LC_VALUE_LABEL] for r in reclass_rows) + 1)
+    zone_numbers = sorted(
+        {
+            int(k[len(ELEV_ZONE_LABEL) :])
+            for r in reclass_rows
+            for k in r
+            if k.startswith(ELEV_ZONE_LABEL)
+        }
+    )
+    include_class = np.zeros(lc_size, dtype=bool)
+    include_height = np.zeros(lc_size, dtype=bool)
+    elev_threshold = np.full((zone_numbers[-1] + 1, lc_size), np.nan, dtype=np.float32)
+    for row in reclass_rows:
+        lc_val = row[LC_VALUE_LABEL]
+        include_class[lc_val] = row[INCLUDE_CLASS] == 1
+        include_height[lc_val] = row[INCLUDE_HEIGHT] == 1
+        for zone in zone_numbers:
+            threshold = row.get(f"{ELEV_ZONE_LABEL}{zone}")
+            if threshold is not None:
+                elev_threshold[zone, lc_val] = threshold
+    return ReclassLookup(include_class, include_height, elev_threshold)
+
+
+def compiled_path(species, cache_dir=CACHE_DIR):
+    # directory of the species' compiled parameters, compiled on first use
+    path = os.path.join(cache_dir, "lookup", f"{species}-{parameter_hash(species)}")
+    if os.path.isdir(path):
+        return path
+    definition = species_definition(species)
+    validate(species, definition["HEIGHT"], definition["LC_RECLASS"])
+    reclass_lookup = compile_lookup(definition["LC_RECLASS"])
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    os.makedirs(tmp_path, exist_ok=True)
+    for field, table in reclass_lookup._asdict().items():
+        np.save(os.path.join(tmp_path, f"{field}.npy"), table)
+    with open(os.path.join(tmp_path, HEIGHT_FILE), "w") as f:
+        json.dump(definition["HEIGHT"], f)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # another process compiled it first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    return path
+
+
+def load_lookup(species, cache_dir=CACHE_DIR):
+    path = compiled_path(species, cache_dir)
+    if path not in _lookups:
+        _lookups[path] = ReclassLookup(
+            *(
+                np.load(os.path.join(path, f"{field}.npy"), mmap_mode="r")
+                for field in ReclassLookup._fields
+            )
+        )
+    return _lookups[path]
+
+
+def load_height(species, cache_dir=CACHE_DIR):
+    # the species' HEIGHT as validated and stored with its compiled lookup
+    path = compiled_path(species, cache_dir)
+    if path not in _heights:
+        with open(os.path.join(path, HEIGHT_FILE)) as f:
+            _heights[path] = json.load(f)
+    return _heights[path]
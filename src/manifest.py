@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import numpy as np
+from raster_io import open_raster
+from tiling import read_input
+
+MANIFEST_VERSION = 2
+
+# A manifest sits next to each local structural_habitat output and records the image ids of
+# its inputs, the species parameters and the tiles it holds. A rerun pointed at a previous
+# output reuses the tiles whose inputs all kept their image id without reading them; only the
+# windows of an input whose id changed are read and digested, and a tile is then reused when
+# those digests match the ones an earlier rerun recorded for it.
+
+
+def manifest_path(output_path):
+    return f"{os.path.splitext(output_path)[0]}.manifest.json"
+
+
+def window_key(window):
+    return ",".join(str(v) for v in window)
+
+
+def array_digest(array):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{array.dtype.str}{array.shape}".encode())
+    digest.update(np.ascontiguousarray(array).data)
+    return digest.hexdigest()
+
+
+class TileManifest:
+    def __init__(self, params, image_ids, tiles=None):
+        self.params = params
+        self.image_ids = image_ids
+        self.tiles = tiles or {}
+
+    @classmethod
+    def load(cls, output_path):
+        path = manifest_path(output_path)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            manifest = json.load(f)
+        if manifest.get("version") != MANIFEST_VERSION:
+            return None
+        return cls(manifest["params"], manifest["image_ids"], manifest["tiles"])
+
+    def save(self, output_path):
+        path = manifest_path(output_path)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "version": MANIFEST_VERSION,
+                    "params": self.params,
+                    "image_ids": self.image_ids,
+                    "tiles": self.tiles,
+                },
+                f,
+            )
+        os.replace(tmp_path, path)
+
+
+class IncrementalRun:
+    def __init__(self, zones, sources, params, previous_outputs, block=10):
+        # zones, params and previous_outputs are keyed by species
+        self.zones = zones
+        self.sources = {k: v for k, v in sources.items() if v is not None}
+        self.block = block
+        self.previous = {}
+        self.manifests = {}
+        for species, zone_source in zones.items():
+            image_ids = {name: s.image_id for name, s in self.sources.items()}
+            image_ids["zones"] = zone_source.image_id
+            self.manifests[species] = TileManifest(params[species], image_ids)
+
+            path = previous_outputs.get(species)
+            previous = TileManifest.load(path) if path else None
+            if previous is not None and previous.params == params[species]:
+                self.previous[species] = (previous, open_raster(path))
+        self.reused = 0
+
+    def _digest(self, name, source, window, counts):
+        array = read_input(name, source, window, self.block)
+        if counts is not None:
+            counts["bytes_read"] += array.nbytes
+        return array_digest(array)
+
+    def plan(self, window, window_species=None, counts=None):
+        # returns the species (of window_species, default all) that need computing for
+        # window, and reused tiles for the rest
+        key = window_key(window)
+        shared = {}
+        compute, reused = [], {}
+        for species, zone_source in self.zones.items():
+            if window_species is not None and species not in window_species:
+                continue
+            previous, previous_output = self.previous.get(species, (None, None))
+            if previous is None or key not in previous.tiles:
+                self.manifests[species].tiles[key] = {}
+                compute.append(species)
+                continue
+
+            previous_digests = previous.tiles[key]
+            digests, unchanged = {}, True
+            for name, source in [("zones", zone_source)] + list(self.sources.items()):
+                if previous.image_ids.get(name) == source.image_id:
+                    if name in previous_digests:
+                        digests[name] = previous_digests[name]
+                    continue
+                if name == "zones":
+                    digests[name] = self._digest(name, source, window, counts)
+                else:
+                    if name not in shared:
+                        shared[name] = self._digest(name, source, window, counts)
+                    digests[name] = shared[name]
+                unchanged &= previous_digests.get(name) == digests[name]
+            self.manifests[species].tiles[key] = digests
+
+            if unchanged:
+                reused[species] = previous_output.read(window)
+                self.reused += 1
+            else:
+                compute.append(species)
+        return compute, reused
+
+    def save(self, output_paths):
+        for species, path in output_paths.items():
+            self.manifests[species].save(path)
+
+    def close(self):
+        for _, previous_output in self.previous.values():
+            previous_output.close()
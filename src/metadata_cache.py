@@ -0,0 +1,45 @@
+import json
+import time
+from keyed_cache import KeyedFileCache
+from parameters import DEFAULT_METADATA_TTL
+
+# Earth Engine metadata resolved before any pixel work, as JSON entries that expire ttl seconds
+# after they were fetched; a ttl of 0 disables the cache.
+
+
+class MetadataCache(KeyedFileCache):
+    name = "metadata"
+    extension = ".json"
+
+    def __init__(self, cache_dir=None, ttl=DEFAULT_METADATA_TTL):
+        super().__init__(cache_dir)
+        self.ttl = ttl
+
+    def get(self, key):
+        if self.ttl <= 0:
+            return None
+        try:
+            with open(self.path(key)) as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if time.time() - entry["fetched"] > self.ttl:
+            return None
+        return entry["metadata"]
+
+    def put(self, key, fields, fetch):
+        metadata = fetch()
+        if self.ttl <= 0:
+            return metadata
+
+        def write(path):
+            with open(path, "w") as f:
+                json.dump(
+                    {"fields": fields, "fetched": time.time(), "metadata": metadata},
+                    f,
+                    sort_keys=True,
+                    default=str,
+                )
+
+        self.write(self.path(key), write)
+        return metadata
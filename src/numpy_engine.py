@@ -0,0 +1,286 @@
+import numpy as np
+import graph
+from lookup import load_lookup
+from parameters import HEIGHT, ZONE_KEY_MULTIPLIER
+
+# Local equivalent of SCLStructruralHabitat.calc. Inputs are 2-d arrays on the output grid
+# (land cover, elevation, zone number with 0 outside all zones) except forest height (and the
+# optional watermask, 1 = land), which are `block` times finer: 30 m pixels under 300 m cells.
+
+
+def remap(image, table):
+    # like ee.Image.remap through a dense lookup table: values outside it come back masked (nan)
+    inside = (image >= 0) & (image < len(table))
+    return np.where(inside, table[np.where(inside, image, 0)], np.nan)
+
+
+def landcover_reclass(land_cover, elevation, zone_mask, elev_zone):
+    return (elevation <= remap(land_cover, elev_zone)) & zone_mask
+
+
+def zone_landcover_keys(land_cover, zones, lc_size):
+    # flat index into a (zone, lc_value) table; -1 (masked) for values outside it
+    keys = zones.astype(np.int64) * lc_size + land_cover
+    return np.where((land_cover >= 0) & (land_cover < lc_size), keys, -1)
+
+
+def _block_count(mask, block):
+    rows, cols = mask.shape[0] // block, mask.shape[1] // block
+    return mask.reshape(rows, block, cols, block).sum(axis=(1, 3), dtype=np.uint16)
+
+
+def forest_pixels(forest_height, block, watermask=None):
+    # forest height cropped to whole blocks, and where it is valid (not nodata, not water)
+    rows, cols = forest_height.shape[0] // block, forest_height.shape[1] // block
+    heights = forest_height[: rows * block, : cols * block]
+    if np.issubdtype(heights.dtype, np.floating):
+        valid = ~np.isnan(heights)
+    else:
+        valid = np.ones(heights.shape, dtype=bool)
+    if watermask is not None:
+        valid &= watermask[: rows * block, : cols * block] != 0
+    return heights, valid
+
+
+def forest_height_mask(
+    forest_height, height_threshold, height_cover_threshold, block, watermask=None
+):
+    # share of valid 30 m pixels (not nodata, not water) at least height_threshold tall in each
+    # block x block cell, like reduceResolution(mean) of the thresholded height. Only boolean
+    # arrays exist at 30 m; both counts come from one reshape-and-sum and are compared as
+    # integers, and cells with no valid pixel stay masked.
+    heights, valid = forest_pixels(forest_height, block, watermask)
+    tall_count = _block_count((heights >= height_threshold) & valid, block)
+    valid_count = _block_count(valid, block)
+    return (valid_count > 0) & (
+        tall_count * 100.0 >= valid_count * float(height_cover_threshold)
+    )
+
+
+def forest_height_masks(
+    forest_height, height_thresholds, height_cover_thresholds, block, watermask=None
+):
+    # forest_height_mask for every (height threshold, cover threshold) pair, shaped
+    # (heights, covers, rows, cols): validity is counted once, tall pixels once per height
+    # threshold, and each cover fraction is compared against every cover threshold
+    heights, valid = forest_pixels(forest_height, block, watermask)
+    valid_count = _block_count(valid, block)
+    cover_bounds = valid_count * np.asarray(
+        height_cover_thresholds, dtype=np.float64
+    ).reshape(-1, 1, 1)
+    masks = []
+    for height_threshold in height_thresholds:
+        tall_percent = (
+            _block_count((heights >= height_threshold) & valid, block) * 100.0
+        )
+        masks.append((valid_count > 0) & (tall_percent >= cover_bounds))
+    return np.stack(masks)
+
+
+def elevation_excess(land_cover, elevation, zones, thresholds):
+    # metres above the (zone, lc_value) elevation ceiling, nan where the class is excluded
+    keys = zone_landcover_keys(land_cover, zones, thresholds.shape[1])
+    return elevation - remap(keys, thresholds.ravel())
+
+
+def structural_habitat(
+    species,
+    land_cover,
+    elevation,
+    zones,
+    forest_height=None,
+    watermask=None,
+    block=10,
+    single_pass=False,
+    zone_numbers=None,
+    lazy=False,
+):
+    # zone_numbers, when the caller already knows which zones the tile holds, spares a scan;
+    # lazy evaluates the same image through the lazy graph instead
+    if lazy:
+        return structural_habitat_lazy(
+            species,
+            land_cover,
+            elevation,
+            zones,
+            forest_height,
+            watermask,
+            block,
+            single_pass,
+            zone_numbers,
+        )
+    height = HEIGHT[species]
+    reclass_lookup = load_lookup(species)
+    # one ceiling per (zone, lc_value) for both branches; height-gated classes are then kept
+    # only where the forest height cover is met (never, for species without forest height)
+    thresholds = reclass_lookup.thresholds()
+    requires_height = reclass_lookup.requires_height
+
+    forest_mask = None
+    if height["INCLUDE"]:
+        if forest_height is None:
+            raise ValueError(f"{species} structural habitat requires forest_height")
+        forest_mask = forest_height_mask(
+            forest_height,
+            height["HEIGHT_THRESHOLD"],
+            height["HEIGHT_COVER_THRESHOLD"],
+            block,
+            watermask,
+        )
+        if forest_mask.shape != land_cover.shape:
+            raise ValueError(
+                f"forest_height {forest_height.shape} does not aggregate by {block} "
+                f"onto land cover grid {land_cover.shape}"
+            )
+
+    if single_pass:
+        # one remap over (zone, lc_value) keys instead of one masked remap per zone
+        keys = zone_landcover_keys(land_cover, zones, len(reclass_lookup.include_class))
+        str_hab = elevation <= remap(keys, thresholds.ravel())
+    else:
+        str_hab = np.zeros(land_cover.shape, dtype=bool)
+        if zone_numbers is None:
+            zone_numbers = np.unique(zones[zones > 0])
+        for zone in zone_numbers:
+            if zone not in reclass_lookup.zone_numbers:
+                continue
+            str_hab |= landcover_reclass(
+                land_cover, elevation, zones == zone, thresholds[zone]
+            )
+
+    return (str_hab & height_allowed(land_cover, requires_height, forest_mask)).astype(
+        np.uint8
+    )
+
+
+def height_allowed(land_cover, requires_height, forest_mask=None):
+    # False where the land cover class requires forest height cover the cell lacks
+    gated = remap(land_cover, requires_height) == 1
+    if forest_mask is None:
+        return ~gated
+    return ~gated | forest_mask
+
+
+def structural_habitat_sweep(
+    species,
+    land_cover,
+    elevation,
+    zones,
+    sweep,
+    forest_height=None,
+    watermask=None,
+    block=10,
+):
+    # structural_habitat for every scenario of the sweep grid, as a (scenarios, rows, cols)
+    # uint8 stack in sweep.scenarios(species) order. Elevation above each ceiling is computed
+    # once and compared against every offset; forest cover is aggregated once per height
+    # threshold and compared against every cover threshold, and gates the height classes.
+    height_thresholds, cover_thresholds, elev_offsets = sweep.values(species)
+    reclass_lookup = load_lookup(species)
+    offsets = np.asarray(elev_offsets, dtype=np.float64).reshape(-1, 1, 1)
+    excess = elevation_excess(land_cover, elevation, zones, reclass_lookup.thresholds())
+    below = excess <= offsets
+    gated = remap(land_cover, reclass_lookup.requires_height) == 1
+    str_hab = np.broadcast_to(
+        below & ~gated, (len(height_thresholds), len(cover_thresholds)) + below.shape
+    )
+
+    if HEIGHT[species]["INCLUDE"]:
+        if forest_height is None:
+            raise ValueError(f"{species} structural habitat requires forest_height")
+        forest_masks = forest_height_masks(
+            forest_height, height_thresholds, cover_thresholds, block, watermask
+        )
+        if forest_masks.shape[2:] != land_cover.shape:
+            raise ValueError(
+                f"forest_height {forest_height.shape} does not aggregate by {block} "
+                f"onto land cover grid {land_cover.shape}"
+            )
+        str_hab = str_hab | (below & gated & forest_masks[:, :, np.newaxis])
+
+    return str_hab.reshape((-1,) + land_cover.shape).astype(np.uint8)
+
+
+def structural_habitat_graph(
+    species, zone_numbers=None, single_pass=False, watermask=True, image_graph=None
+):
+    # the image calc_ee builds for species, recorded as a lazy graph; as in calc_ee every zone
+    # builds its own remap and zone mask, and the graph merges the duplicates
+    image_graph = image_graph or graph.Graph()
+    height = HEIGHT[species]
+    reclass_lookup = load_lookup(species)
+    land_cover = image_graph.source("land_cover_esa")
+    elevation = image_graph.source("elevation")
+    zones = image_graph.source("zones")
+
+    def forest_height_mask():
+        forest_height = image_graph.source("forest_height", fine=True)
+        if watermask:
+            forest_height = forest_height.updateMask(
+                image_graph.source("watermask", fine=True)
+            )
+        return (
+            forest_height.gte(height["HEIGHT_THRESHOLD"])
+            .reduceResolution("mean")
+            .reproject()
+            .gte(height["HEIGHT_COVER_THRESHOLD"] / 100)
+        )
+
+    if single_pass:
+        zone_lc = zones.toInt().multiply(ZONE_KEY_MULTIPLIER).add(land_cover)
+        str_hab = elevation.lte(zone_lc.remap(*reclass_lookup.zone_keys())).selfMask()
+    else:
+        if zone_numbers is None:
+            zone_numbers = reclass_lookup.zone_numbers
+        zone_tables = reclass_lookup.zone_tables()
+        images = [
+            elevation.lte(land_cover.remap(*zone_tables[zone]))
+            .updateMask(zones.eq(zone))
+            .selfMask()
+            for zone in zone_numbers
+            if zone in reclass_lookup.zone_numbers
+        ]
+        if not images:
+            return None
+        str_hab = graph.ImageCollection(images).mosaic()
+
+    allowed = reclass_lookup.height_allowed(
+        land_cover, forest_height_mask if height["INCLUDE"] else None
+    )
+    if allowed is not None:
+        str_hab = str_hab.And(allowed).selfMask()
+    return str_hab
+
+
+def structural_habitat_lazy(
+    species,
+    land_cover,
+    elevation,
+    zones,
+    forest_height=None,
+    watermask=None,
+    block=10,
+    single_pass=False,
+    zone_numbers=None,
+    chunk_rows=graph.DEFAULT_CHUNK_ROWS,
+):
+    # structural_habitat evaluated through the lazy graph, chunk_rows output rows at a time
+    if HEIGHT[species]["INCLUDE"] and forest_height is None:
+        raise ValueError(f"{species} structural habitat requires forest_height")
+    if zone_numbers is None and not single_pass:
+        zone_numbers = np.unique(zones[zones > 0]).tolist()
+    image_graph = graph.Graph()
+    str_hab = structural_habitat_graph(
+        species, zone_numbers, single_pass, watermask is not None, image_graph
+    )
+    if str_hab is None:
+        return np.zeros(land_cover.shape, dtype=np.uint8)
+    arrays = {
+        "land_cover_esa": land_cover,
+        "elevation": elevation,
+        "zones": zones,
+        "forest_height": forest_height,
+        "watermask": watermask,
+    }
+    ((data, mask),) = image_graph.evaluate([str_hab], arrays, block, chunk_rows)
+    return (mask & (data != 0)).astype(np.uint8)
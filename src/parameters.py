@@ -1,36 +1,86 @@
-from Panthera_tigris_pars import (
-    HEIGHT as PANTHERA_TIGRIS_HEIGHT,
-    LC_RECLASS as PANTHERA_TIGRIS_LC_RECLASS,
-)
-from Panthera_leo_pars import (
-    HEIGHT as PANTHERA_LEO_HEIGHT,
-    LC_RECLASS as PANTHERA_LEO_LC_RECLASS,
-)
-from Panthera_onca_pars import (
-    HEIGHT as PANTHERA_ONCA_HEIGHT,
-    LC_RECLASS as PANTHERA_ONCA_LC_RECLASS,
-)
-from Bison_bison_pars import (
-    HEIGHT as BISON_BISON_HEIGHT,
-    LC_RECLASS as BISON_BISON_LC_RECLASS,
-)
+import importlib
+import os
+import tempfile
+from collections.abc import Mapping
+from lazy_import import lazy_import
 
 BIOME_ZONE_LABEL = "Zone"
 ELEV_ZONE_LABEL = "elev_zone"
 LC_VALUE_LABEL = "lc_value"
 INCLUDE_CLASS = "include_class"
 INCLUDE_HEIGHT = "include_height"
+FOREST_HEIGHT_SCALE = 30
+# single-pass lookups key pixels on zone * ZONE_KEY_MULTIPLIER + lc_value
+ZONE_KEY_MULTIPLIER = 1000
+ENGINES = ("ee", "numpy")
+DEFAULT_TILE_SIZE = 512
+DEFAULT_INPUT_CACHE_MB = 20480
+DEFAULT_EXPORT_RETRIES = 2
+# seconds cached Earth Engine metadata (image ids and dates, zones) stays valid
+DEFAULT_METADATA_TTL = 3600
+CACHE_DIR = os.environ.get(
+    "SCL_CACHE_DIR", os.path.join(tempfile.gettempdir(), "scl_structural_habitat")
+)
+
+SPECIES_DIR = os.environ.get(
+    "SCL_SPECIES_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "species"),
+)
+SPECIES_FILE_EXTENSIONS = (".yaml", ".yml", ".csv", ".parquet")
+# HEIGHT rows for species defined by a CSV / Parquet table
+HEIGHT_TABLE = "height.csv"
+
+species_params = lazy_import("species_params")
+lookup = lazy_import("lookup")
+
+
+def species_files(species_dir=SPECIES_DIR):
+    # {species: definition file} for the species files in species_dir
+    if not os.path.isdir(species_dir):
+        return {}
+    files = {}
+    for name in sorted(os.listdir(species_dir)):
+        species, ext = os.path.splitext(name)
+        if ext in SPECIES_FILE_EXTENSIONS and name != HEIGHT_TABLE:
+            files.setdefault(species, os.path.join(species_dir, name))
+    return files
+
+
+# Species parameters live in <species>_pars modules, imported the first time a species is looked
+# up so that runs (and --help) only pay for the species they touch, or in species files (see
+# species_params), which need no code change and take precedence over a module of the same name.
+PARS_SPECIES = ["Panthera_tigris", "Panthera_leo", "Panthera_onca", "Bison_bison"]
+SPECIES_FILES = species_files()
+SPECIES = PARS_SPECIES + [s for s in SPECIES_FILES if s not in PARS_SPECIES]
+
+
+def species_definition(species):
+    # {"HEIGHT": ..., "LC_RECLASS": ...} from the species file or <species>_pars module
+    if species in SPECIES_FILES:
+        return species_params.load_species(SPECIES_FILES[species])
+    if species not in SPECIES:
+        raise KeyError(species)
+    module = importlib.import_module(f"{species}_pars")
+    return {"HEIGHT": module.HEIGHT, "LC_RECLASS": module.LC_RECLASS}
+
+
+class SpeciesRegistry(Mapping):
+    # {species: <species>_pars.<attribute>, or the same from the species file}
+    def __init__(self, attribute):
+        self.attribute = attribute
+
+    def __getitem__(self, species):
+        if species in SPECIES_FILES and self.attribute == "HEIGHT":
+            # kept with the compiled lookup, so the file is only parsed when it changes
+            return lookup.load_height(species)
+        return species_definition(species)[self.attribute]
+
+    def __iter__(self):
+        return iter(SPECIES)
+
+    def __len__(self):
+        return len(SPECIES)
+
 
-HEIGHT = {
-    "Panthera_tigris": PANTHERA_TIGRIS_HEIGHT,
-    "Panthera_leo": PANTHERA_LEO_HEIGHT,
-    "Panthera_onca": PANTHERA_ONCA_HEIGHT,
-    "Bison_bison": BISON_BISON_HEIGHT,
-}
-
-LC_ELEV_RECLASS_ESA = {
-    "Panthera_tigris": PANTHERA_TIGRIS_LC_RECLASS,
-    "Panthera_leo": PANTHERA_LEO_LC_RECLASS,
-    "Panthera_onca": PANTHERA_ONCA_LC_RECLASS,
-    "Bison_bison": BISON_BISON_LC_RECLASS,
-}
+HEIGHT = SpeciesRegistry("HEIGHT")
+LC_ELEV_RECLASS_ESA = SpeciesRegistry("LC_RECLASS")
@@ -0,0 +1,109 @@
+import contextlib
+import json
+import os
+import resource
+import time
+
+METRIC_PREFIX = "scl_structural_habitat_stage"
+METRICS = {
+    "seconds": "Wall time spent in the stage",
+    "calls": "Times the stage was entered",
+    "pixels": "Pixels processed by the stage",
+    "bytes_read": "Input bytes read by the stage",
+    "max_rss_bytes": "Process resident memory high-water mark at the end of the stage",
+}
+
+
+def max_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class RunProfile:
+    # Named-stage counters for a run. Disabled profiles hand out a throwaway record so
+    # instrumented code needs no branches; enabled ones accumulate per stage name.
+    def __init__(self, enabled=False, labels=None):
+        self.enabled = enabled
+        self.labels = labels or {}
+        self.stages = {}
+
+    def _record(self, name):
+        return self.stages.setdefault(
+            name,
+            {
+                "seconds": 0.0,
+                "calls": 0,
+                "pixels": 0,
+                "bytes_read": 0,
+                "max_rss_bytes": 0,
+            },
+        )
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield {"pixels": 0, "bytes_read": 0}
+            return
+        counts = {"pixels": 0, "bytes_read": 0}
+        start = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            self.add(
+                name,
+                seconds=time.perf_counter() - start,
+                calls=1,
+                max_rss_bytes=max_rss_bytes(),
+                **counts,
+            )
+
+    def add(self, name, **counts):
+        if not self.enabled:
+            return
+        record = self._record(name)
+        for key, value in counts.items():
+            if key == "max_rss_bytes":
+                record[key] = max(record[key], value)
+            else:
+                record[key] += value
+
+    def merge(self, stages):
+        # fold in stages recorded by another process (tile workers)
+        for name, counts in stages.items():
+            self.add(name, **counts)
+
+    def report(self):
+        return {
+            "labels": self.labels,
+            "max_rss_bytes": max_rss_bytes(),
+            "stages": self.stages,
+        }
+
+    def write_json(self, path):
+        _write_atomic(path, json.dumps(self.report(), indent=2) + "\n")
+
+    def write_prometheus(self, path):
+        lines = []
+        for metric, help_text in METRICS.items():
+            name = f"{METRIC_PREFIX}_{metric}"
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+            for stage, record in self.stages.items():
+                labels = ",".join(
+                    f'{k}="{v}"' for k, v in {**self.labels, "stage": stage}.items()
+                )
+                lines.append(f"{name}{{{labels}}} {record[metric]}")
+        _write_atomic(path, "\n".join(lines) + "\n")
+
+    def save(self, json_path=None, prometheus_path=None):
+        if json_path:
+            self.write_json(json_path)
+        if prometheus_path:
+            self.write_prometheus(prometheus_path)
+
+
+def _write_atomic(path, text):
+    # textfile collectors must never see a half-written file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
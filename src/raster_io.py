@@ -0,0 +1,280 @@
+import json
+import os
+import shutil
+from typing import NamedTuple
+import numpy as np
+
+TILESET_EXTENSION = ".tiles"
+BITMASK_EXTENSION = ".bits"
+RASTER_EXTENSIONS = (".tif", ".npy", TILESET_EXTENSION)
+GTIFF_BLOCK_SIZE = 256
+TILESET_INDEX = "index.json"
+
+
+class Window(NamedTuple):
+    row_off: int
+    col_off: int
+    height: int
+    width: int
+
+    def scaled(self, factor):
+        return Window(*(v * factor for v in self))
+
+    def slices(self):
+        return (
+            slice(self.row_off, self.row_off + self.height),
+            slice(self.col_off, self.col_off + self.width),
+        )
+
+
+def find_raster(directory, name):
+    for ext in RASTER_EXTENSIONS:
+        path = os.path.join(directory, f"{name}{ext}")
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(
+        f"No {' or '.join(RASTER_EXTENSIONS)} raster named {name} in {directory}"
+    )
+
+
+def _rasterio():
+    try:
+        import rasterio
+    except ImportError as e:
+        raise ImportError("GeoTIFF input/output requires rasterio") from e
+    return rasterio
+
+
+class RasterSource:
+    # windowed reader over a single band .npy (memory-mapped) or GeoTIFF; float nodata reads
+    # as nan, integer nodata is left to the caller (tiling.read_input)
+    def __init__(self, path, image_id=None, nodata=None):
+        self.path = path
+        if image_id is None:
+            stat = os.stat(path)
+            image_id = f"{os.path.abspath(path)}:{stat.st_mtime_ns}:{stat.st_size}"
+        self.image_id = image_id
+        if path.endswith(".npy"):
+            self._dataset = None
+            self._array = np.load(path, mmap_mode="r")
+            self.profile = None
+            self.shape = self._array.shape
+            self.dtype = self._array.dtype
+            self.nodata = nodata
+        else:
+            self._dataset = _rasterio().open(path)
+            self.profile = self._dataset.profile
+            self.shape = (self._dataset.height, self._dataset.width)
+            self.dtype = np.dtype(self._dataset.dtypes[0])
+            self.nodata = self.profile.get("nodata") if nodata is None else nodata
+
+    def read(self, window=None):
+        window = window or Window(0, 0, *self.shape)
+        if self._dataset is None:
+            array = np.array(self._array[window.slices()])
+        else:
+            rasterio = _rasterio()
+            array = self._dataset.read(
+                1,
+                window=rasterio.windows.Window(
+                    window.col_off, window.row_off, window.width, window.height
+                ),
+            )
+        if self.nodata is not None and np.issubdtype(array.dtype, np.floating):
+            array[array == self.nodata] = np.nan
+        return array
+
+    def close(self):
+        if self._dataset is not None:
+            self._dataset.close()
+        self._array = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def grid_profile(index):
+    # rasterio-style profile from the crs and transform stored in a sidecar index
+    if not index.get("transform"):
+        return None
+    return {"crs": index["crs"], "transform": _rasterio().Affine(*index["transform"])}
+
+
+class TileSetSource:
+    # directory of fixed-size .npy tiles plus an index.json sidecar listing the nonzero values
+    # in each tile; tiles that were never written (all zero) are not stored and read as zeros
+    def __init__(self, path, image_id=None):
+        self.path = path
+        with open(os.path.join(path, TILESET_INDEX)) as f:
+            self.index = json.load(f)
+        self.image_id = image_id or self.index.get("image_id") or path
+        self.shape = tuple(self.index["shape"])
+        self.dtype = np.dtype(self.index["dtype"])
+        self.tile_size = self.index["tile_size"]
+        self.tiles = self.index["tiles"]
+        self.metadata = self.index.get("metadata", {})
+        self.profile = grid_profile(self.index)
+
+    def read(self, window=None):
+        window = window or Window(0, 0, *self.shape)
+        array = np.zeros((window.height, window.width), dtype=self.dtype)
+        size = self.tile_size
+        for row in range(
+            window.row_off // size, -(-(window.row_off + window.height) // size)
+        ):
+            for col in range(
+                window.col_off // size, -(-(window.col_off + window.width) // size)
+            ):
+                if f"{row}_{col}" not in self.tiles:
+                    continue
+                tile = np.load(
+                    os.path.join(self.path, f"{row}_{col}.npy"), mmap_mode="r"
+                )
+                row_min = max(window.row_off, row * size)
+                col_min = max(window.col_off, col * size)
+                row_max = min(
+                    window.row_off + window.height, row * size + tile.shape[0]
+                )
+                col_max = min(window.col_off + window.width, col * size + tile.shape[1])
+                array[
+                    row_min - window.row_off : row_max - window.row_off,
+                    col_min - window.col_off : col_max - window.col_off,
+                ] = tile[
+                    row_min - row * size : row_max - row * size,
+                    col_min - col * size : col_max - col * size,
+                ]
+        return array
+
+    def tile_values(self, window):
+        # nonzero values in the stored tiles window overlaps, from the index alone
+        size = self.tile_size
+        values = set()
+        for row in range(
+            window.row_off // size, -(-(window.row_off + window.height) // size)
+        ):
+            for col in range(
+                window.col_off // size, -(-(window.col_off + window.width) // size)
+            ):
+                values.update(self.tiles.get(f"{row}_{col}", ()))
+        return sorted(values)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_tileset(
+    path, shape, dtype, tile_size, tiles, grid=None, image_id=None, metadata=None
+):
+    # tiles yields (window, array) on the tile_size grid; all-zero tiles are dropped. The set
+    # is assembled next to path and renamed into place, so readers never see a partial one.
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    stored = {}
+    for window, array in tiles:
+        if array.any():
+            key = f"{window.row_off // tile_size}_{window.col_off // tile_size}"
+            np.save(os.path.join(tmp_path, f"{key}.npy"), array.astype(dtype))
+            stored[key] = [v.item() for v in np.unique(array[array != 0])]
+    grid = grid or {}
+    with open(os.path.join(tmp_path, TILESET_INDEX), "w") as f:
+        json.dump(
+            {
+                "shape": list(shape),
+                "dtype": np.dtype(dtype).name,
+                "tile_size": tile_size,
+                "tiles": stored,
+                "crs": grid.get("crs"),
+                "transform": grid.get("transform"),
+                "image_id": image_id,
+                "metadata": metadata or {},
+            },
+            f,
+        )
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    return path
+
+
+def open_raster(path, image_id=None):
+    if path.endswith(BITMASK_EXTENSION):
+        from bitmask import BitMaskSource
+
+        return BitMaskSource(path, image_id)
+    if path.endswith(TILESET_EXTENSION):
+        return TileSetSource(path, image_id)
+    return RasterSource(path, image_id)
+
+
+def open_sink(path, shape, dtype, profile=None, nodata=0):
+    if path.endswith(BITMASK_EXTENSION):
+        from bitmask import BitMaskSink
+
+        return BitMaskSink(path, shape, profile)
+    return RasterSink(path, shape, dtype, profile, nodata)
+
+
+class RasterSink:
+    # window-by-window writer; GeoTIFF output is tiled so unwritten tiles stay sparse nodata
+    def __init__(self, path, shape, dtype, profile=None, nodata=0):
+        self.path = path
+        if path.endswith(".npy"):
+            self._dataset = None
+            self._array = np.lib.format.open_memmap(
+                path, mode="w+", dtype=dtype, shape=shape
+            )
+            if nodata:
+                self._array[:] = nodata
+            return
+
+        profile = dict(profile or {})
+        profile.update(
+            driver="GTiff",
+            height=shape[0],
+            width=shape[1],
+            count=1,
+            dtype=np.dtype(dtype).name,
+            nodata=nodata,
+            compress="deflate",
+            tiled=True,
+            blockxsize=GTIFF_BLOCK_SIZE,
+            blockysize=GTIFF_BLOCK_SIZE,
+            BIGTIFF="IF_SAFER",
+        )
+        self._dataset = _rasterio().open(path, "w", **profile)
+
+    def write(self, window, array):
+        if self._dataset is None:
+            self._array[window.slices()] = array
+            return
+
+        rasterio = _rasterio()
+        self._dataset.write(
+            array,
+            1,
+            window=rasterio.windows.Window(
+                window.col_off, window.row_off, window.width, window.height
+            ),
+        )
+
+    def close(self):
+        if self._dataset is None:
+            self._array.flush()
+            self._array = None
+        else:
+            self._dataset.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
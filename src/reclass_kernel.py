@@ -0,0 +1,217 @@
+import numpy as np
+from lookup import load_lookup
+from parameters import HEIGHT
+
+# Evaluated op by op, the reclass allocates a full-size temporary at every step (remap, lte,
+# updateMask, the 30 m forest height chain). The fused kernel turns land cover, elevation,
+# zones and forest height into the str_hab byte per pixel writing only into buffers that are
+# allocated on the first tile and reused for every tile after it. With numba the reclass and
+# the forest cover aggregation are each one compiled loop; without it they are numpy ufunc
+# calls writing into the same buffers (out=), so steady-state tiles allocate next to nothing.
+# A kernel's output buffer is reused too: the returned tile is valid until its next call.
+
+_kernels = {}
+
+
+def _numba():
+    try:
+        import numba
+    except ImportError:
+        return None
+    return numba
+
+
+def _forest_cover_loop(
+    heights, watermask, has_watermask, height_threshold, cover_threshold, block, forest
+):
+    # numpy_engine.forest_height_mask in one pass over the 30 m pixels of each cell
+    rows, cols = forest.shape
+    for row in range(rows):
+        for col in range(cols):
+            tall = 0
+            valid = 0
+            for i in range(row * block, (row + 1) * block):
+                for j in range(col * block, (col + 1) * block):
+                    height = heights[i, j]
+                    if height != height or (has_watermask and watermask[i, j] == 0):
+                        continue
+                    valid += 1
+                    if height >= height_threshold:
+                        tall += 1
+            forest[row, col] = valid > 0 and tall * 100.0 >= valid * cover_threshold
+
+
+def _reclass_loop(
+    land_cover, elevation, zones, ceilings, requires_height, forest, has_forest, out
+):
+    # str_hab per pixel from the (zone, lc_value) elevation ceilings, height-gated classes
+    # only where the cell has forest height cover
+    zone_rows, lc_size = ceilings.shape
+    rows, cols = out.shape
+    for row in range(rows):
+        for col in range(cols):
+            zone = zones[row, col]
+            lc_value = land_cover[row, col]
+            habitat = False
+            if 0 < zone < zone_rows and 0 <= lc_value < lc_size:
+                habitat = elevation[row, col] <= ceilings[zone, lc_value]
+                if habitat and requires_height[lc_value]:
+                    habitat = has_forest and forest[row, col]
+            out[row, col] = habitat
+
+
+numba = _numba()
+if numba is not None:
+    _forest_cover_loop = numba.njit(cache=True, nogil=True)(_forest_cover_loop)
+    _reclass_loop = numba.njit(cache=True, nogil=True)(_reclass_loop)
+
+
+class Workspace:
+    # named flat scratch buffers, grown on demand and viewed at each tile's shape
+    def __init__(self):
+        self.buffers = {}
+
+    def get(self, name, shape, dtype):
+        size = int(np.prod(shape))
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.dtype != dtype or buffer.size < size:
+            buffer = self.buffers[name] = np.empty(size, dtype=dtype)
+        return buffer[:size].reshape(shape)
+
+
+# scratch shared by every kernel in the process; tiles are evaluated one at a time
+_workspace = Workspace()
+
+
+class ReclassKernel:
+    def __init__(self, species, block=10, jit=None, workspace=None):
+        height = HEIGHT[species]
+        reclass_lookup = load_lookup(species)
+        self.species = species
+        self.block = block
+        self.jit = numba is not None if jit is None else jit
+        self.include_height = height["INCLUDE"]
+        self.height_threshold = height["HEIGHT_THRESHOLD"]
+        self.height_cover_threshold = height["HEIGHT_COVER_THRESHOLD"]
+        self.workspace = workspace or _workspace
+        self.out = Workspace()
+        self.thresholds = reclass_lookup.thresholds().astype(np.float32)
+        self.requires_height = np.ascontiguousarray(reclass_lookup.requires_height)
+        # a nan column (and a False flag) past the last lc_value catches land cover outside
+        # the table, and clipped keys of zones past the last row land on the final nan
+        zone_rows, lc_size = self.thresholds.shape
+        padded = np.full((zone_rows, lc_size + 1), np.nan, dtype=np.float32)
+        padded[:, :-1] = self.thresholds
+        self.padded_thresholds = padded.ravel()
+        self.padded_requires_height = np.append(self.requires_height, False)
+        self.lc_size = np.intp(lc_size)
+
+    def forest_mask(self, forest_height, watermask=None):
+        block = self.block
+        rows, cols = forest_height.shape[0] // block, forest_height.shape[1] // block
+        forest = self.workspace.get("forest", (rows, cols), bool)
+        heights = forest_height[: rows * block, : cols * block]
+        if self.jit:
+            has_watermask = watermask is not None
+            _forest_cover_loop(
+                heights,
+                watermask if has_watermask else heights,
+                has_watermask,
+                self.height_threshold,
+                float(self.height_cover_threshold),
+                block,
+                forest,
+            )
+            return forest
+
+        fine = heights.shape
+        valid = self.workspace.get("valid", fine, bool)
+        tall = self.workspace.get("tall", fine, bool)
+        if np.issubdtype(heights.dtype, np.floating):
+            np.isnan(heights, out=valid)
+            np.logical_not(valid, out=valid)
+        else:
+            valid.fill(True)
+        if watermask is not None:
+            np.not_equal(watermask[: rows * block, : cols * block], 0, out=tall)
+            np.logical_and(valid, tall, out=valid)
+        np.greater_equal(heights, self.height_threshold, out=tall)
+        np.logical_and(tall, valid, out=tall)
+
+        counts = {}
+        for name, mask in (("tall", tall), ("valid", valid)):
+            counts[name] = self.workspace.get(f"{name}_count", (rows, cols), np.uint16)
+            mask.reshape(rows, block, cols, block).sum(
+                axis=(1, 3), dtype=np.uint16, out=counts[name]
+            )
+        tall_percent = self.workspace.get("tall_percent", (rows, cols), np.float64)
+        cover_bound = self.workspace.get("cover_bound", (rows, cols), np.float64)
+        np.multiply(counts["tall"], 100.0, out=tall_percent)
+        np.multiply(
+            counts["valid"], float(self.height_cover_threshold), out=cover_bound
+        )
+        np.greater_equal(tall_percent, cover_bound, out=forest)
+        any_valid = self.workspace.get("any_valid", (rows, cols), bool)
+        np.greater(counts["valid"], 0, out=any_valid)
+        return np.logical_and(forest, any_valid, out=forest)
+
+    def __call__(
+        self, land_cover, elevation, zones, forest_height=None, watermask=None
+    ):
+        shape = land_cover.shape
+        out = self.out.get("str_hab", shape, np.uint8)
+        forest = None
+        if self.include_height:
+            if forest_height is None:
+                raise ValueError(
+                    f"{self.species} structural habitat requires forest_height"
+                )
+            forest = self.forest_mask(forest_height, watermask)
+            if forest.shape != shape:
+                raise ValueError(
+                    f"forest_height {forest_height.shape} does not aggregate by "
+                    f"{self.block} onto land cover grid {shape}"
+                )
+
+        if self.jit:
+            _reclass_loop(
+                land_cover,
+                elevation,
+                zones,
+                self.thresholds,
+                self.requires_height,
+                out if forest is None else forest,
+                forest is not None,
+                out,
+            )
+            return out
+
+        # flat (zone, lc_value) keys into the padded ceilings, lc_value keys into the flags
+        keys = self.workspace.get("keys", shape, np.intp)
+        lc_keys = self.workspace.get("lc_keys", shape, np.intp)
+        np.multiply(zones, self.lc_size + 1, out=keys)
+        np.minimum(land_cover, self.lc_size, out=lc_keys)
+        if np.issubdtype(land_cover.dtype, np.signedinteger):
+            np.copyto(lc_keys, self.lc_size, where=land_cover < 0)
+        np.add(keys, lc_keys, out=keys)
+        ceiling = self.workspace.get("ceiling", shape, np.float32)
+        habitat = out.view(bool)
+        np.take(self.padded_thresholds, keys, out=ceiling, mode="clip")
+        np.less_equal(elevation, ceiling, out=habitat)
+        allowed = self.workspace.get("allowed", shape, bool)
+        np.take(self.padded_requires_height, lc_keys, out=allowed, mode="clip")
+        if forest is None:
+            np.logical_not(allowed, out=allowed)
+        else:
+            # not requires_height or forest
+            np.less_equal(allowed, forest, out=allowed)
+        np.logical_and(habitat, allowed, out=habitat)
+        return out
+
+
+def kernel(species, block=10):
+    # one kernel per species and block per process, so its buffers outlive each tile
+    key = (species, block)
+    if key not in _kernels:
+        _kernels[key] = ReclassKernel(species, block)
+    return _kernels[key]
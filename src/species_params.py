@@ -0,0 +1,198 @@
+import csv
+import numbers
+import os
+import sys
+from parameters import (
+    ELEV_ZONE_LABEL,
+    HEIGHT_TABLE,
+    INCLUDE_CLASS,
+    INCLUDE_HEIGHT,
+    LC_VALUE_LABEL,
+)
+
+HEIGHT_KEYS = ("INCLUDE", "HEIGHT_THRESHOLD", "HEIGHT_COVER_THRESHOLD")
+TRUE_STRINGS = ("1", "true", "yes")
+FALSE_STRINGS = ("0", "false", "no", "")
+
+# Species can be onboarded as data instead of a <species>_pars module. A <species>.yaml file in
+# the species directory holds the same HEIGHT mapping and LC_RECLASS list a module does; a
+# <species>.csv or .parquet file holds just the LC_RECLASS table (one row per land cover class,
+# one elev_zone<N> column per zone), its HEIGHT row coming from the directory's height.csv.
+# Every definition is validated before it is used.
+
+_species = {}
+
+
+class SpeciesParameterError(ValueError):
+    pass
+
+
+def _yaml():
+    try:
+        import yaml
+    except ImportError as e:
+        raise ImportError("YAML species files require PyYAML") from e
+    return yaml
+
+
+def _parquet():
+    try:
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("Parquet species files require pyarrow") from e
+    return pyarrow.parquet
+
+
+def _cell(value):
+    # csv cells are strings: blank is missing, numbers are parsed, labels stay text
+    value = value.strip()
+    if not value:
+        return None
+    for parse in (int, float):
+        try:
+            return parse(value)
+        except ValueError:
+            pass
+    return value
+
+
+def read_table(path):
+    # [{column: value}] rows of a CSV or Parquet table, leaving out missing cells
+    if path.endswith(".parquet"):
+        rows = _parquet().read_table(path).to_pylist()
+    else:
+        with open(path, newline="") as f:
+            rows = [{k: _cell(v) for k, v in row.items()} for row in csv.DictReader(f)]
+    return [{k: v for k, v in row.items() if v is not None} for row in rows]
+
+
+def _flag(value):
+    if isinstance(value, str):
+        if value.lower() in TRUE_STRINGS + FALSE_STRINGS:
+            return value.lower() in TRUE_STRINGS
+        raise SpeciesParameterError(f"INCLUDE {value!r} is not true or false")
+    return bool(value)
+
+
+def read_height_table(path):
+    # {species: HEIGHT} from a table with species, INCLUDE and threshold columns
+    if not os.path.exists(path):
+        return {}
+    return {
+        row["species"]: {
+            "INCLUDE": _flag(row.get("INCLUDE", "")),
+            "HEIGHT_THRESHOLD": row.get("HEIGHT_THRESHOLD"),
+            "HEIGHT_COVER_THRESHOLD": row.get("HEIGHT_COVER_THRESHOLD"),
+        }
+        for row in read_table(path)
+    }
+
+
+def read_species_file(path):
+    # {"HEIGHT": {...}, "LC_RECLASS": [...]} as a <species>_pars module would define them
+    species = os.path.splitext(os.path.basename(path))[0]
+    if path.endswith((".yaml", ".yml")):
+        with open(path) as f:
+            definition = _yaml().safe_load(f) or {}
+        return {
+            "HEIGHT": definition.get("HEIGHT"),
+            "LC_RECLASS": definition.get("LC_RECLASS"),
+        }
+    heights = read_height_table(os.path.join(os.path.dirname(path), HEIGHT_TABLE))
+    return {"HEIGHT": heights.get(species), "LC_RECLASS": read_table(path)}
+
+
+def _is_number(value):
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+
+def validation_errors(height, reclass_rows):
+    errors = []
+    if not isinstance(height, dict):
+        errors.append("HEIGHT is missing")
+    elif "INCLUDE" not in height:
+        errors.append("HEIGHT has no INCLUDE")
+    elif height["INCLUDE"]:
+        for key in HEIGHT_KEYS[1:]:
+            if not _is_number(height.get(key)):
+                errors.append(f"HEIGHT INCLUDE is true but {key} is not a number")
+        cover = height.get("HEIGHT_COVER_THRESHOLD")
+        if _is_number(cover) and not 0 <= cover <= 100:
+            errors.append(f"HEIGHT_COVER_THRESHOLD {cover} is not a percentage")
+
+    if not reclass_rows:
+        return errors + ["LC_RECLASS has no rows"]
+    zone_columns = None
+    lc_values = set()
+    for i, row in enumerate(reclass_rows):
+        where = f"LC_RECLASS row {i} ({row.get('label', row.get(LC_VALUE_LABEL))})"
+        lc_value = row.get(LC_VALUE_LABEL)
+        if not isinstance(lc_value, int) or lc_value < 0:
+            errors.append(
+                f"{where}: {LC_VALUE_LABEL} {lc_value!r} is not a non-negative integer"
+            )
+        elif lc_value in lc_values:
+            errors.append(f"{where}: duplicate {LC_VALUE_LABEL} {lc_value}")
+        lc_values.add(lc_value)
+        for key in (INCLUDE_CLASS, INCLUDE_HEIGHT):
+            if row.get(key) not in (0, 1):
+                errors.append(f"{where}: {key} {row.get(key)!r} is not 0 or 1")
+
+        columns = sorted(k for k in row if k.startswith(ELEV_ZONE_LABEL))
+        for column in columns:
+            zone = column[len(ELEV_ZONE_LABEL) :]
+            if not zone.isdigit() or int(zone) < 1:
+                errors.append(
+                    f"{where}: {column} is not {ELEV_ZONE_LABEL}<zone number>"
+                )
+            elif not _is_number(row[column]):
+                errors.append(f"{where}: {column} {row[column]!r} is not a number")
+        if zone_columns is None:
+            zone_columns = columns
+            if not columns:
+                errors.append(f"{where}: no {ELEV_ZONE_LABEL}<N> columns")
+        elif columns != zone_columns:
+            errors.append(
+                f"{where}: elevation zones {columns} differ from {zone_columns} in row 0"
+            )
+    return errors
+
+
+def validate(species, height, reclass_rows):
+    errors = validation_errors(height, reclass_rows)
+    if errors:
+        raise SpeciesParameterError(
+            f"invalid parameters for {species}:\n  " + "\n  ".join(errors)
+        )
+
+
+def load_species(path):
+    # validated definition of the species in path, read once per process
+    if path not in _species:
+        species = os.path.splitext(os.path.basename(path))[0]
+        definition = read_species_file(path)
+        validate(species, definition["HEIGHT"], definition["LC_RECLASS"])
+        _species[path] = definition
+    return _species[path]
+
+
+if __name__ == "__main__":
+    # validate and compile every species (or the given ones): python species_params.py [species]
+    from lookup import load_lookup
+    from parameters import SPECIES, species_definition
+
+    failed = False
+    for species in sys.argv[1:] or SPECIES:
+        try:
+            definition = species_definition(species)
+            validate(species, definition["HEIGHT"], definition["LC_RECLASS"])
+            reclass_lookup = load_lookup(species)
+        except (KeyError, SpeciesParameterError) as e:
+            print(e if isinstance(e, SpeciesParameterError) else f"unknown species {e}")
+            failed = True
+            continue
+        print(
+            f"{species}: {len(reclass_lookup.zone_numbers)} elevation zone(s), "
+            f"{int(reclass_lookup.include_class.sum())} habitat land cover class(es)"
+        )
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,113 @@
+import csv
+import itertools
+import os
+from typing import NamedTuple, Optional, Tuple
+import numpy as np
+from parameters import HEIGHT
+from zone_raster import METERS_PER_DEGREE
+
+SWEEP_PARAMETERS = ("height_threshold", "height_cover_threshold", "elev_offset")
+SWEEP_SUFFIX = "_sweep.csv"
+
+# Sensitivity runs evaluate a grid of parameter values in one pass over the inputs instead of
+# one run per combination: every scenario is a (height threshold, cover threshold, elevation
+# offset) triple, the offset being metres added to every elevation ceiling. Instead of an
+# output raster per scenario, each species gets a table of habitat pixels and area.
+
+
+def _number(value):
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+class SweepGrid(NamedTuple):
+    # values swept per parameter; None keeps the species' own value (elevation offset 0)
+    height_thresholds: Optional[Tuple[float, ...]] = None
+    height_cover_thresholds: Optional[Tuple[float, ...]] = None
+    elev_offsets: Optional[Tuple[float, ...]] = None
+
+    @classmethod
+    def parse(cls, spec):
+        # "height_threshold=3,5,7 height_cover_threshold=50,75 elev_offset=-250,0,250"
+        values = {}
+        for item in spec.replace(";", " ").split():
+            name, _, numbers = item.partition("=")
+            if name not in SWEEP_PARAMETERS or not numbers:
+                raise ValueError(
+                    f"sweep item {item!r} is not <parameter>=<value>[,<value>...] with "
+                    f"parameter one of {', '.join(SWEEP_PARAMETERS)}"
+                )
+            values[name] = tuple(_number(v) for v in numbers.split(","))
+        return cls(*(values.get(name) for name in SWEEP_PARAMETERS))
+
+    def values(self, species):
+        # (height thresholds, cover thresholds, elevation offsets) to evaluate for species;
+        # height values only apply to species that use forest height
+        height = HEIGHT[species]
+        if not height["INCLUDE"]:
+            return (None,), (None,), self.elev_offsets or (0,)
+        return (
+            self.height_thresholds or (height["HEIGHT_THRESHOLD"],),
+            self.height_cover_thresholds or (height["HEIGHT_COVER_THRESHOLD"],),
+            self.elev_offsets or (0,),
+        )
+
+    def scenarios(self, species):
+        return list(itertools.product(*self.values(species)))
+
+
+def row_areas(profile, rows, scale):
+    # km2 covered by one cell of each grid row
+    transform = (profile or {}).get("transform")
+    if transform is None:
+        return np.full(rows, (scale / 1000) ** 2)
+    a, _, _, _, e, f = list(transform)[:6]
+    if str(profile.get("crs")).upper() == "EPSG:4326":
+        latitudes = np.radians(f + (np.arange(rows) + 0.5) * e)
+        return abs(a * e) * METERS_PER_DEGREE**2 * np.cos(latitudes) / 1e6
+    return np.full(rows, abs(a * e) / 1e6)
+
+
+class SweepTable:
+    # stands in for an output sink: sums the (scenarios, rows, cols) tiles written to it into
+    # habitat pixels and area per scenario, saved as CSV on close
+    def __init__(self, path, scenarios, areas):
+        self.path = path
+        self.scenarios = scenarios
+        self.areas = areas
+        self.pixels = np.zeros(len(scenarios), dtype=np.int64)
+        self.area = np.zeros(len(scenarios), dtype=np.float64)
+
+    def write(self, window, tiles):
+        row_pixels = tiles.sum(axis=2, dtype=np.int64)
+        self.pixels += row_pixels.sum(axis=1)
+        self.area += (
+            row_pixels @ self.areas[window.row_off : window.row_off + window.height]
+        )
+
+    def rows(self):
+        return [
+            {
+                **dict(zip(SWEEP_PARAMETERS, scenario)),
+                "habitat_pixels": int(pixels),
+                "habitat_km2": round(float(area), 3),
+            }
+            for scenario, pixels, area in zip(self.scenarios, self.pixels, self.area)
+        ]
+
+    def close(self):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", newline="") as f:
+            writer = csv.DictWriter(
+                f, SWEEP_PARAMETERS + ("habitat_pixels", "habitat_km2")
+            )
+            writer.writeheader()
+            writer.writerows(self.rows())
+        os.replace(tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
@@ -1,19 +1,59 @@
-import argparse
-import ee
+import contextlib
+import functools
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from task_base import SCLTask
+import cli
+import ee_cassette
+from lazy_import import lazy_import
+from lookup import load_lookup, parameter_hash
+from profiling import RunProfile
 from parameters import (
     BIOME_ZONE_LABEL,
-    ELEV_ZONE_LABEL,
-    LC_VALUE_LABEL,
-    INCLUDE_CLASS,
-    INCLUDE_HEIGHT,
+    DEFAULT_EXPORT_RETRIES,
+    DEFAULT_INPUT_CACHE_MB,
+    DEFAULT_METADATA_TTL,
+    DEFAULT_TILE_SIZE,
+    ENGINES,
+    FOREST_HEIGHT_SCALE,
     HEIGHT,
-    LC_ELEV_RECLASS_ESA,
+    ZONE_KEY_MULTIPLIER,
 )
 
+# backend modules load on first use: ee for the ee engine (and numpy engine fetches), tiling
+# and the local caches for the numpy engine, the async export loop for ee exports
+ee = lazy_import("ee")
+exports = lazy_import("exports")
+input_cache = lazy_import("input_cache")
+manifest = lazy_import("manifest")
+metadata_cache = lazy_import("metadata_cache")
+raster_io = lazy_import("raster_io")
+graph = lazy_import("graph")
+numpy_engine = lazy_import("numpy_engine")
+sweep = lazy_import("sweep")
+tiling = lazy_import("tiling")
+zone_raster = lazy_import("zone_raster")
 
-def reclass_list_to_fc(dictionary):
-    return ee.Feature(None, dictionary)
+# numpy engine inputs that can be fetched from Earth Engine into the local input cache
+EE_FETCH_DTYPES = {
+    "land_cover_esa": "uint8",
+    "elevation": "int16",
+    "forest_height": "float32",
+}
+EE_FETCH_NODATA = -9999
+COMPUTE_PIXELS_WINDOW = 1024
+PREVIEW_RADIUS = 50000
+PREVIEW_MAX_ERROR = 1000
+PREVIEW_DIMENSIONS = 256
+ZONES_GEOJSON = "zones.geojson"
+ZONES_RASTER_MAX_PIXELS = 1e13
+EE_QUEUED_STATES = ("READY", "RUNNING")
+
+# zones raster assets this process has started exporting
+_zones_raster_exports = set()
 
 
 class SCLStructruralHabitat(SCLTask):
@@ -42,105 +82,753 @@ class SCLStructruralHabitat(SCLTask):
     }
 
     def __init__(self, *args, **kwargs):
+        self.profile_path = kwargs.get("profile")
+        self.prometheus_textfile = kwargs.get("prometheus_textfile")
+        self.run_profile = RunProfile(
+            enabled=bool(self.profile_path or self.prometheus_textfile)
+        )
+        with self.run_profile.stage("init"):
+            self._init(*args, **kwargs)
+
+    def _init(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.land_cover_esa, _ = self.get_most_recent_image(
-            ee.ImageCollection(self.inputs["land_cover_esa"]["ee_path"])
+        self.engine = kwargs.get("engine") or "ee"
+        if self.engine not in ENGINES:
+            raise ValueError(f"engine must be one of {ENGINES}, not {self.engine}")
+        self.input_dir = kwargs.get("input_dir") or "."
+        self.output_dir = kwargs.get("output_dir") or "."
+        self.single_pass = kwargs.get("single_pass") or False
+        self.lazy = kwargs.get("lazy") or False
+        self.explain = kwargs.get("explain") or False
+        self.tile_size = int(kwargs.get("tile_size") or DEFAULT_TILE_SIZE)
+        self.workers = int(kwargs.get("workers") or 1)
+        self.previous_output_dir = kwargs.get("previous_output_dir")
+        self.preview = kwargs.get("preview") or False
+        self.bit_packed = kwargs.get("bit_packed") or False
+        self.sweep_grid = kwargs.get("sweep")
+        if isinstance(self.sweep_grid, str):
+            self.sweep_grid = sweep.SweepGrid.parse(self.sweep_grid)
+        if self.sweep_grid and self.engine != "numpy":
+            raise ValueError("a parameter sweep needs the numpy engine")
+        self.export_splits = int(kwargs.get("export_splits") or 1)
+        self.export_retries = int(
+            kwargs.get("export_retries") or DEFAULT_EXPORT_RETRIES
         )
-        self.forest_height, _ = self.get_most_recent_image(
-            ee.ImageCollection(self.inputs["forest_height"]["ee_path"])
+        self.defer_exports = kwargs.get("defer_exports") or False
+        self.export_jobs = []
+        self.batch_species = kwargs.get("batch_species") or [self.species]
+        self.batch_height = any(HEIGHT[s]["INCLUDE"] for s in self.batch_species)
+        self.run_profile.labels.update(
+            species=",".join(self.batch_species), engine=self.engine
         )
-        self.elevation = (
-            ee.ImageCollection(self.inputs["elevation"]["ee_path"]).select(0).mosaic()
+        metadata_ttl = kwargs.get("metadata_ttl")
+        self.metadata_cache = metadata_cache.MetadataCache(
+            ttl=DEFAULT_METADATA_TTL if metadata_ttl is None else int(metadata_ttl)
         )
-        self.zones = ee.FeatureCollection(self.inputs["zones"]["ee_path"])
-        self.zone_numbers = self.zones.aggregate_histogram(BIOME_ZONE_LABEL).keys()
-        self.zones_image = self.zones.reduceToImage(
-            properties=[BIOME_ZONE_LABEL], reducer=ee.Reducer.mode()
-        ).rename(BIOME_ZONE_LABEL)
-        self.reclass_table = ee.FeatureCollection(
-            ee.List(LC_ELEV_RECLASS_ESA[self.species]).map(reclass_list_to_fc)
-        ).filter(ee.Filter.eq(INCLUDE_CLASS, 1))
+        self.input_cache = None
+        self.zone_raster_cache = None
+        if self.engine == "numpy":
+            self.zone_raster_cache = zone_raster.ZoneRasterCache()
+            self.input_cache = input_cache.InputCache(
+                max_bytes=int(kwargs.get("input_cache_mb") or DEFAULT_INPUT_CACHE_MB)
+                * 2**20
+            )
         self.height = HEIGHT[self.species]["INCLUDE"]
         self.height_threshold = HEIGHT[self.species]["HEIGHT_THRESHOLD"]
         self.height_cover_threshold = HEIGHT[self.species]["HEIGHT_COVER_THRESHOLD"]
+        self.height_aggregations = 0
+        with self.run_profile.stage("load_lookup"):
+            self.reclass_lookup = load_lookup(self.species)
+        if self.engine == "ee":
+            self.init_ee_inputs()
+
+    def init_ee_inputs(self):
+        zones_path = self.inputs["zones"]["ee_path"]
+        with self.run_profile.stage("resolve_inputs"):
+            metadata_key, fields = self.metadata_cache.key(
+                species=self.species,
+                taskdate=self.taskdate,
+                inputs={name: self.inputs[name]["ee_path"] for name in self.inputs},
+                scale=self.scale,
+                crs=self.crs,
+            )
+            metadata = self.metadata_cache.get_or_put(
+                metadata_key, fields, lambda: self.fetch_ee_metadata(zones_path)
+            )
+        images = metadata["images"]
+        self.land_cover_esa = ee.Image(images["land_cover_esa"]["id"])
+        self.forest_height = ee.Image(images["forest_height"]["id"])
+        self.input_image_ids = {
+            name: f"{image['id']}@{image['time_start']}"
+            for name, image in images.items()
+        }
+        self.input_image_ids["elevation"] = "static"
+        self.elevation = (
+            ee.ImageCollection(self.inputs["elevation"]["ee_path"]).select(0).mosaic()
+        )
+        with self.run_profile.stage("zones_raster"):
+            self.init_ee_zones(zones_path, metadata)
+            # only ee runs that compute provision the raster; numpy runs fetching an input
+            # just read it, and previews and --explain leave the asset alone
+            if (
+                self.engine == "ee"
+                and not self.preview
+                and not self.explain
+                and not metadata["zones_raster"]
+            ):
+                self.export_zones_raster(zones_path, metadata)
+                metadata = {**metadata, "zones_raster": "queued"}
+                self.metadata_cache.put(metadata_key, fields, lambda: metadata)
 
-    def species_zones(self):
-        return f"projects/SCL/v1/{self.species}/zones"
+    def most_recent_image_info(self, name):
+        # id and start time of the latest image of an input within its maxage (in years)
+        # of the task date, as a server-side dictionary
+        taskdate = ee.Date(str(self.taskdate))
+        image = (
+            ee.ImageCollection(self.inputs[name]["ee_path"])
+            .filterDate(
+                taskdate.advance(-self.inputs[name]["maxage"], "year"),
+                taskdate.advance(1, "day"),
+            )
+            .sort("system:time_start", False)
+            .first()
+        )
+        return ee.Dictionary(
+            {"id": image.get("system:id"), "time_start": image.get("system:time_start")}
+        )
+
+    def fetch_ee_metadata(self, zones_path):
+        # what init_ee_inputs needs from the server: the computed values (most recent
+        # images, zone numbers) in a single getInfo sent alongside the zones asset lookup,
+        # then the lookup of the raster of that version of the zones
+        computed = ee.Dictionary(
+            {
+                "land_cover_esa": self.most_recent_image_info("land_cover_esa"),
+                "forest_height": self.most_recent_image_info("forest_height"),
+                "zone_numbers": ee.FeatureCollection(zones_path)
+                .aggregate_histogram(BIOME_ZONE_LABEL)
+                .keys(),
+            }
+        )
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            values = pool.submit(computed.getInfo)
+            update_time = ee.data.getAsset(zones_path)["updateTime"]
+            raster_asset = self.ee_asset_or_none(
+                self.zones_raster_path(zones_path, update_time)
+            )
+            values = values.result()
+        return {
+            "images": {
+                name: values[name] for name in ("land_cover_esa", "forest_height")
+            },
+            "zone_numbers": sorted(int(float(zone)) for zone in values["zone_numbers"]),
+            "zones_update_time": update_time,
+            "zones_raster": None if raster_asset is None else "ready",
+        }
+
+    @staticmethod
+    def ee_asset_or_none(asset_path):
+        try:
+            return ee.data.getAsset(asset_path)
+        except ee.EEException:
+            return None
+
+    def zones_raster_path(self, zones_path, update_time):
+        # one raster asset per version of the zones, so that no run ever replaces an asset
+        # another run may be reading
+        zones_id = f"{zones_path}@{update_time}"
+        version = hashlib.sha256(zones_id.encode()).hexdigest()[:12]
+        crs = self.crs.replace(":", "_")
+        return f"{zones_path}_raster_{self.scale}m_{crs}_{version}"
+
+    def init_ee_zones(self, zones_path, metadata):
+        # the raster of this version of the zones once it exists, else reduceToImage
+        self.zones = ee.FeatureCollection(zones_path)
+        self.zone_numbers = metadata["zone_numbers"]
+        raster_path = self.zones_raster_path(zones_path, metadata["zones_update_time"])
+        if metadata["zones_raster"] == "ready":
+            self.zones_image = ee.Image(raster_path).rename(BIOME_ZONE_LABEL)
+            return
+        self.zones_image = (
+            self.zones.reduceToImage(
+                properties=[BIOME_ZONE_LABEL], reducer=ee.Reducer.mode()
+            )
+            .toUint8()
+            .rename(BIOME_ZONE_LABEL)
+        )
+
+    @staticmethod
+    def ee_export_queued(description):
+        return any(
+            task.get("description") == description
+            and task.get("state") in EE_QUEUED_STATES
+            for task in ee.data.getTaskList()
+        )
+
+    def export_zones_raster(self, zones_path, metadata):
+        # start the export of this version's raster unless this process or another run
+        # already queued it
+        raster_path = self.zones_raster_path(zones_path, metadata["zones_update_time"])
+        description = f"{self.species}_{os.path.basename(raster_path)}"
+        if raster_path in _zones_raster_exports or self.ee_export_queued(description):
+            return
+        _zones_raster_exports.add(raster_path)
+        ee.batch.Export.image.toAsset(
+            image=self.zones_image.set(
+                {"zones_id": f"{zones_path}@{metadata['zones_update_time']}"}
+            ),
+            description=description,
+            assetId=raster_path,
+            region=self.zones.geometry().bounds(),
+            scale=self.scale,
+            crs=self.crs,
+            pyramidingPolicy={".default": "mode"},
+            maxPixels=ZONES_RASTER_MAX_PIXELS,
+        ).start()
+        print(f"exporting zones raster to {raster_path} for reuse by later runs")
+
+    def ee_zones_id(self, zones_path):
+        key, fields = self.metadata_cache.key(asset=zones_path)
+        update_time = self.metadata_cache.get_or_put(
+            key, fields, lambda: ee.data.getAsset(zones_path)["updateTime"]
+        )
+        return f"{zones_path}@{update_time}"
+
+    def species_zones(self, species=None):
+        return f"projects/SCL/v1/{species or self.species}/zones"
 
     def landcover_reclass(self, lc_val, elev_zone, zone):
+        with self.run_profile.stage("landcover_reclass"):
+            return (
+                self.elevation.lte(self.land_cover_esa.remap(lc_val, elev_zone))
+                .updateMask(self.zones_image.eq(zone))
+                .selfMask()
+            )
+
+    def forest_height_mask(self):
+        # zone-independent 30 m -> 300 m aggregation: build once per run, share across zones
+        self.height_aggregations += 1
         return (
-            self.elevation.lte(self.land_cover_esa.remap(lc_val, elev_zone))
-            .updateMask(self.zones_image.eq(zone))
-            .selfMask()
+            self.forest_height.updateMask(self.watermask)
+            .gte(self.height_threshold)
+            .reduceResolution(reducer=ee.Reducer.mean(), maxPixels=125)
+            .reproject(scale=self.scale, crs=self.crs)
+            .gte(self.height_cover_threshold / 100)
         )
 
     def calc(self):
-        lc_height = self.reclass_table.filter(ee.Filter.eq(INCLUDE_HEIGHT, 1))
-        lc_height_vals = lc_height.aggregate_array(LC_VALUE_LABEL)
-        lc_no_height = self.reclass_table.filter(ee.Filter.eq(INCLUDE_HEIGHT, 0))
-        lc_no_height_vals = lc_no_height.aggregate_array(LC_VALUE_LABEL)
+        with self.run_profile.stage("calc"):
+            if self.explain:
+                self.explain_graph()
+            elif self.engine == "numpy":
+                self.calc_numpy()
+            else:
+                self.calc_ee()
+        self.run_profile.save(self.profile_path, self.prometheus_textfile)
 
-        def str_hab_by_zone(zone):
-            zone_string = ee.String(zone)
-            zone_number = ee.Number.parse(zone)
-            column = ee.String(ELEV_ZONE_LABEL).cat(zone_string)
-            elev_zone_esa_no_height = lc_no_height.aggregate_array(column)
-            elev_zone_esa_height = lc_height.aggregate_array(column)
-
-            reclass_img_esa_no_height = self.landcover_reclass(
-                lc_no_height_vals, elev_zone_esa_no_height, zone_number
-            )
-
-            if self.height:
-                forest_height_mask = (
-                    self.forest_height.updateMask(self.watermask)
-                    .gte(self.height_threshold)
-                    .reduceResolution(reducer=ee.Reducer.mean(), maxPixels=125)
-                    .reproject(scale=self.scale, crs=self.crs)
-                    .gte(self.height_cover_threshold / 100)
+    def explain_graph(self):
+        # print the operations calc() asks of the backend, recorded as a lazy graph with
+        # duplicate operations merged and in-place chains marked
+        for species in self.batch_species:
+            zone_numbers = None
+            if self.engine == "ee" and species == self.species:
+                zone_numbers = self.zone_numbers
+            image_graph = graph.Graph()
+            str_hab = numpy_engine.structural_habitat_graph(
+                species, zone_numbers, self.single_pass, image_graph=image_graph
+            )
+            if str_hab is None:
+                print(f"{species}: no zone has parameters")
+                continue
+            print(f"{species}: {image_graph.describe([str_hab])}")
+
+    def fetch_ee_pixels(self, image, grid, out):
+        scale_x, shear_x, translate_x, shear_y, scale_y, translate_y = grid["transform"]
+        rows, cols = out.shape
+        for row_off in range(0, rows, COMPUTE_PIXELS_WINDOW):
+            for col_off in range(0, cols, COMPUTE_PIXELS_WINDOW):
+                height = min(COMPUTE_PIXELS_WINDOW, rows - row_off)
+                width = min(COMPUTE_PIXELS_WINDOW, cols - col_off)
+                pixels = ee.data.computePixels(
+                    {
+                        "expression": image,
+                        "fileFormat": "NUMPY_NDARRAY",
+                        "grid": {
+                            "dimensions": {"width": width, "height": height},
+                            "affineTransform": {
+                                "scaleX": scale_x,
+                                "shearX": shear_x,
+                                "translateX": translate_x + col_off * scale_x,
+                                "shearY": shear_y,
+                                "scaleY": scale_y,
+                                "translateY": translate_y + row_off * scale_y,
+                            },
+                            "crsCode": grid["crs"],
+                        },
+                    }
                 )
-                reclass_img_esa_height = self.landcover_reclass(
-                    lc_height_vals, elev_zone_esa_height, zone_number
-                ).updateMask(forest_height_mask)
-
-                str_hab_image = ee.Image(
-                    ee.Algorithms.If(
-                        lc_no_height_vals.length().eq(0),
-                        reclass_img_esa_height,
-                        ee.ImageCollection(
-                            [reclass_img_esa_no_height, reclass_img_esa_no_height]
-                        ).reduce(ee.Reducer.max()),
+                window = pixels[pixels.dtype.names[0]]
+                if np.issubdtype(out.dtype, np.floating):
+                    window = np.where(window == EE_FETCH_NODATA, np.nan, window)
+                out[row_off : row_off + height, col_off : col_off + width] = window
+
+    def cached_ee_input(self, name, grid_source):
+        # resample an ee input onto the local zones grid once, then reuse the memmapped copy
+        if grid_source.profile is None:
+            raise FileNotFoundError(
+                f"No local {name} raster, and fetching it from Earth Engine needs a "
+                "georeferenced zones GeoTIFF to define the grid"
+            )
+        if not hasattr(self, "input_image_ids"):
+            self.init_ee_inputs()
+
+        factor = self.scale // FOREST_HEIGHT_SCALE if name == "forest_height" else 1
+        transform = grid_source.profile["transform"]
+        grid = {
+            "crs": str(grid_source.profile["crs"]),
+            "transform": [
+                transform.a / factor,
+                transform.b,
+                transform.c,
+                transform.d,
+                transform.e / factor,
+                transform.f,
+            ],
+        }
+        shape = (grid_source.shape[0] * factor, grid_source.shape[1] * factor)
+        dtype = EE_FETCH_DTYPES[name]
+        image = getattr(self, name).select([0], ["b1"])
+        if np.issubdtype(dtype, np.floating):
+            # masked pixels come back as nan
+            image = image.unmask(EE_FETCH_NODATA).toFloat()
+            nodata = None
+        else:
+            # or as a nodata value, which the engines exclude rather than read as data
+            nodata = 0 if dtype == "uint8" else EE_FETCH_NODATA
+            image = image.unmask(nodata).cast({"b1": dtype})
+        key, fields = self.input_cache.key(
+            self.inputs[name]["ee_path"],
+            self.input_image_ids[name],
+            self.scale // factor,
+            grid["crs"],
+            {**grid, "shape": shape},
+            nodata,
+        )
+        path = self.input_cache.get_or_put(
+            key,
+            fields,
+            shape,
+            dtype,
+            lambda out: self.fetch_ee_pixels(image, grid, out),
+        )
+        return raster_io.RasterSource(path, image_id=key, nodata=nodata)
+
+    def input_directories(self, species=None):
+        # species-specific inputs (zones) live in <input_dir>/<species>/ when batching
+        if species:
+            return [os.path.join(self.input_dir, species), self.input_dir]
+        return [self.input_dir]
+
+    def open_local_input(self, name, required=True, species=None, grid_source=None):
+        directories = self.input_directories(species)
+        for directory in directories:
+            try:
+                return raster_io.open_raster(raster_io.find_raster(directory, name))
+            except FileNotFoundError:
+                pass
+        if grid_source is not None and name in EE_FETCH_DTYPES:
+            return self.cached_ee_input(name, grid_source)
+        if required:
+            raise FileNotFoundError(f"No local {name} raster in {directories}")
+        return None
+
+    def fetch_ee_zone_features(self, zones_path):
+        features, page_token = [], None
+        while True:
+            params = {"expression": ee.FeatureCollection(zones_path)}
+            if page_token:
+                params["pageToken"] = page_token
+            page = ee.data.computeFeatures(params)
+            features += page["features"]
+            page_token = page.get("next_page_token")
+            if not page_token:
+                return zone_raster.zone_features({"features": features})
+
+    def local_grid(self):
+        # the grid of a georeferenced local input, or None to fit one to the zones
+        for name in ("land_cover_esa", "elevation"):
+            source = self.open_local_input(name, required=False)
+            if source is not None:
+                with source:
+                    if source.profile is not None:
+                        return zone_raster.raster_grid(source)
+        return None
+
+    def open_zones(self, species):
+        zones = self.find_zones(species)
+        land_cover = self.open_local_input("land_cover_esa", required=False)
+        if land_cover is not None:
+            with land_cover:
+                if zones.shape != land_cover.shape:
+                    zones.close()
+                    raise ValueError(
+                        f"{species} zones grid {zones.shape} does not match land_cover_esa "
+                        f"{land_cover.shape}; rasterising zones onto the land cover grid "
+                        "needs a georeferenced land_cover_esa or elevation GeoTIFF"
                     )
+        return zones
+
+    def find_zones(self, species):
+        # a local zones raster, else the cached rasterisation of local GeoJSON zones or of
+        # the species' zones asset, rebuilt only when that source changes
+        zones = self.open_local_input("zones", required=False, species=species)
+        if zones is not None:
+            return zones
+        for directory in self.input_directories(species):
+            path = os.path.join(directory, ZONES_GEOJSON)
+            if os.path.exists(path):
+                stat = os.stat(path)
+                zones_id = f"{os.path.abspath(path)}:{stat.st_mtime_ns}:{stat.st_size}"
+                features = functools.partial(zone_raster.read_zone_features, path)
+                break
+        else:
+            zones_path = self.species_zones(species)
+            zones_id = self.ee_zones_id(zones_path)
+            features = functools.partial(self.fetch_ee_zone_features, zones_path)
+        key, fields = self.zone_raster_cache.key(
+            species, zones_id, self.scale, self.crs, self.local_grid()
+        )
+        return self.zone_raster_cache.get_or_put(key, fields, features)
+
+    @staticmethod
+    def batch_grid(zones):
+        # the grid every species' zones share; each species' polygons are rasterised onto a
+        # grid fitted to them unless a georeferenced local input pins one down
+        (first, grid_source), *others = zones.items()
+        for species, zone_source in others:
+            if zone_source.shape != grid_source.shape or (
+                zone_source.profile or {}
+            ).get("transform") != (grid_source.profile or {}).get("transform"):
+                raise ValueError(
+                    f"{species} zones grid does not match {first}'s; batching species "
+                    "needs their zones on one grid, e.g. rasterised onto a georeferenced "
+                    "land_cover_esa or elevation GeoTIFF"
                 )
+        return grid_source
+
+    def local_output_path(self, species, ext, output_dir=None):
+        output_dir = output_dir or self.output_dir
+        if self.scenario:
+            output_dir = os.path.join(output_dir, self.scenario)
+        if len(self.batch_species) > 1:
+            output_dir = os.path.join(output_dir, species)
+        os.makedirs(output_dir, exist_ok=True)
+        return os.path.join(output_dir, f"structural_habitat{ext}")
+
+    def calc_numpy(self):
+        block = self.scale // FOREST_HEIGHT_SCALE
+        if self.previous_output_dir and os.path.samefile(
+            self.previous_output_dir, self.output_dir
+        ):
+            raise ValueError("--previous-output-dir must differ from --output-dir")
+        with contextlib.ExitStack() as stack:
+            zones = {
+                species: stack.enter_context(self.open_zones(species))
+                for species in self.batch_species
+            }
+            grid_source = self.batch_grid(zones)
+            inputs = [("land_cover_esa", True), ("elevation", True)]
+            if self.batch_height:
+                inputs += [("forest_height", True), ("watermask", False)]
+            sources = {}
+            with self.run_profile.stage("open_inputs"):
+                for name, required in inputs:
+                    source = self.open_local_input(
+                        name, required, grid_source=grid_source
+                    )
+                    sources[name] = source and stack.enter_context(source)
+
+            if self.preview:
+                estimate = tiling.preview_structural_habitat(
+                    zones,
+                    sources,
+                    self.tile_size,
+                    block,
+                    self.single_pass,
+                    self.lazy,
+                )
+                print(json.dumps(estimate, indent=2))
+                return
+            if self.sweep_grid:
+                self.sweep_numpy(zones, sources, grid_source, block)
+                return
+
+            land_cover = sources["land_cover_esa"]
+            profile = land_cover.profile or grid_source.profile
+            if self.bit_packed:
+                ext = raster_io.BITMASK_EXTENSION
             else:
-                str_hab_image = reclass_img_esa_no_height
+                ext = ".tif" if profile else ".npy"
+            output_paths = {
+                species: self.local_output_path(species, ext)
+                for species in self.batch_species
+            }
+            previous_outputs = {}
+            if self.previous_output_dir:
+                for species in self.batch_species:
+                    path = self.local_output_path(
+                        species, ext, self.previous_output_dir
+                    )
+                    if os.path.exists(path):
+                        previous_outputs[species] = path
+            incremental = manifest.IncrementalRun(
+                zones,
+                sources,
+                {
+                    species: {"lookup": parameter_hash(species), "block": block}
+                    for species in self.batch_species
+                },
+                previous_outputs,
+                block=block,
+            )
+            stack.callback(incremental.close)
+
+            sinks = {
+                species: stack.enter_context(
+                    raster_io.open_sink(path, land_cover.shape, np.uint8, profile)
+                )
+                for species, path in output_paths.items()
+            }
+            tiles = tiling.stream_structural_habitat(
+                zones,
+                sources,
+                sinks,
+                tile_size=self.tile_size,
+                block=block,
+                single_pass=self.single_pass,
+                workers=self.workers,
+                incremental=incremental,
+                lazy=self.lazy,
+                profile=self.run_profile,
+            )
+        incremental.save(output_paths)
+        print(
+            f"structural habitat computed over {tiles} tile(s) "
+            f"for {', '.join(self.batch_species)}"
+        )
+        if self.previous_output_dir:
+            print(
+                f"{incremental.reused} species tile(s) unchanged and reused from "
+                f"{self.previous_output_dir}"
+            )
+
+    def sweep_numpy(self, zones, sources, grid_source, block):
+        land_cover = sources["land_cover_esa"]
+        areas = sweep.row_areas(
+            land_cover.profile or grid_source.profile, land_cover.shape[0], self.scale
+        )
+        with contextlib.ExitStack() as stack:
+            tables = {
+                species: stack.enter_context(
+                    sweep.SweepTable(
+                        self.local_output_path(species, sweep.SWEEP_SUFFIX),
+                        self.sweep_grid.scenarios(species),
+                        areas,
+                    )
+                )
+                for species in self.batch_species
+            }
+            tiles = tiling.stream_structural_habitat(
+                zones,
+                sources,
+                tables,
+                tile_size=self.tile_size,
+                block=block,
+                workers=self.workers,
+                profile=self.run_profile,
+                sweep=self.sweep_grid,
+            )
+        print(f"parameter sweep computed over {tiles} tile(s)")
+        for species, table in tables.items():
+            print(f"{species} -> {table.path}")
+            for row in table.rows():
+                print(
+                    "  "
+                    + ", ".join(f"{k}={v}" for k, v in row.items() if v is not None)
+                )
 
-            return str_hab_image.gt(0).selfMask()
+    def height_allowed(self):
+        # 1 where the land cover class may be habitat: classes that require forest height
+        # only where the forest height cover is met (never, for species without it)
+        return self.reclass_lookup.height_allowed(
+            self.land_cover_esa, self.forest_height_mask if self.height else None
+        )
+
+    def calc_ee(self):
+        # one elevation ceiling per (zone, lc_value) covers the classes with and without
+        # forest height; the height-gated ones are then masked by height_allowed
+        zone_tables = ee.Dictionary(
+            {
+                str(zone): list(table)
+                for zone, table in self.reclass_lookup.zone_tables().items()
+            }
+        )
+
+        def str_hab_by_zone(zone):
+            table = ee.List(zone_tables.get(str(zone)))
+            return self.landcover_reclass(
+                ee.List(table.get(0)), ee.List(table.get(1)), zone
+            )
+
+        if self.single_pass:
+            # one remap keyed on zone * ZONE_KEY_MULTIPLIER + lc_value covers every zone
+            zone_lc = (
+                self.zones_image.toInt()
+                .multiply(ZONE_KEY_MULTIPLIER)
+                .add(self.land_cover_esa)
+            )
+            structural_habitat = self.elevation.lte(
+                zone_lc.remap(*self.reclass_lookup.zone_keys())
+            ).selfMask()
+        else:
+            structural_habitat = ee.ImageCollection(
+                [
+                    str_hab_by_zone(zone)
+                    for zone in self.zone_numbers
+                    if zone in self.reclass_lookup.zone_numbers
+                ]
+            ).mosaic()
+        allowed = self.height_allowed()
+        if allowed is not None:
+            structural_habitat = structural_habitat.And(allowed).selfMask()
+        structural_habitat = structural_habitat.rename("str_hab")
+        print(f"forest height aggregation ran {self.height_aggregations} time(s)")
+        if self.preview:
+            with self.run_profile.stage("preview"):
+                self.preview_ee(structural_habitat)
+        else:
+            with self.run_profile.stage("export"):
+                self.export_jobs += self.structural_habitat_exports(structural_habitat)
+                if not self.defer_exports:
+                    self.run_exports()
+
+    def start_export(self, image, asset_path, region=None):
+        # export_image_ee records the ee task it starts in ee_tasks; hand back its id
+        return exports.submit_tracked(
+            self.ee_tasks, lambda: self.export_image_ee(image, asset_path, region)
+        )
+
+    def discard_export(self, task_id):
+        self.ee_tasks.pop(task_id, None)
 
-        structural_habitat = (
-            ee.ImageCollection(self.zone_numbers.map(str_hab_by_zone))
-            .mosaic()
-            .rename("str_hab")
+    @staticmethod
+    def ee_export_status(task_id):
+        status = ee.data.getTaskStatus(task_id)[0]
+        return status["state"], None, status.get("error_message")
+
+    def structural_habitat_exports(self, structural_habitat):
+        # one export, or export_splits longitude strips of the zones' bounds exported side
+        # by side so a failed strip is retried alone
+        name = "/".join(
+            filter(None, [self.species, self.scenario, "structural_habitat"])
         )
-        print(structural_habitat.getInfo())
-        exit()
+        if self.export_splits == 1:
+            return [
+                exports.ExportJob(
+                    name,
+                    functools.partial(
+                        self.start_export, structural_habitat, "structural_habitat"
+                    ),
+                    self.discard_export,
+                )
+            ]
+        ring = self.zones.geometry(PREVIEW_MAX_ERROR).bounds(PREVIEW_MAX_ERROR)
+        (x_min, y_min), _, (x_max, y_max), *_ = ring.coordinates().get(0).getInfo()
+        step = (x_max - x_min) / self.export_splits
+        jobs = []
+        for i in range(self.export_splits):
+            part = f"structural_habitat_{i + 1}of{self.export_splits}"
+            region = ee.Geometry.Rectangle(
+                [x_min + i * step, y_min, x_min + (i + 1) * step, y_max],
+                proj=None,
+                geodesic=False,
+            )
+            jobs.append(
+                exports.ExportJob(
+                    f"{name}_{i + 1}of{self.export_splits}",
+                    functools.partial(
+                        self.start_export, structural_habitat, part, region
+                    ),
+                    self.discard_export,
+                )
+            )
+        return jobs
+
+    def export_options(self):
+        options = {"retries": self.export_retries}
+        if ee_cassette.replaying():
+            # replayed exports finish as soon as they are polled: no need to wait in between
+            options["poll_seconds"] = 0
+        return options
 
-        self.export_image_ee(structural_habitat, "structural_habitat")
+    def run_exports(self, jobs=None):
+        exports.export_all(
+            self.export_jobs if jobs is None else jobs,
+            self.ee_export_status,
+            **self.export_options(),
+        )
+
+    def preview_ee(self, structural_habitat):
+        # graph size is known client side; the bounded sample and thumbnail are requested
+        # concurrently instead of a blocking getInfo on the full continental image
+        graph = ee.serializer.encode(structural_habitat, for_cloud_api=True)
+        zones_geometry = self.zones.geometry(PREVIEW_MAX_ERROR)
+        region = (
+            zones_geometry.centroid(PREVIEW_MAX_ERROR)
+            .buffer(PREVIEW_RADIUS, PREVIEW_MAX_ERROR)
+            .bounds(PREVIEW_MAX_ERROR)
+        )
+        sample = ee.Dictionary(
+            {
+                "estimated_output_pixels": zones_geometry.bounds(PREVIEW_MAX_ERROR)
+                .area(PREVIEW_MAX_ERROR)
+                .divide(self.scale**2)
+                .round(),
+                "sample_habitat_pixels": structural_habitat.reduceRegion(
+                    reducer=ee.Reducer.count(),
+                    geometry=region,
+                    scale=self.scale,
+                    crs=self.crs,
+                ).get("str_hab"),
+            }
+        )
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            stats = pool.submit(sample.getInfo)
+            thumbnail = pool.submit(
+                structural_habitat.getThumbURL,
+                {
+                    "region": region,
+                    "dimensions": PREVIEW_DIMENSIONS,
+                    "min": 0,
+                    "max": 1,
+                },
+            )
+            estimate = {
+                "graph_nodes": len(graph.get("values", {})),
+                "graph_bytes": len(json.dumps(graph)),
+                **stats.result(),
+                "thumbnail": thumbnail.result(),
+            }
+        print(json.dumps(estimate, indent=2))
 
     def check_inputs(self):
+        if self.engine == "numpy":
+            # inputs missing from --input-dir are fetched by open_local_input when it can
+            for species in self.batch_species:
+                self.open_zones(species).close()
+            return
         super().check_inputs()
 
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument("-d", "--taskdate")
-    parser.add_argument("-s", "--species")
-    parser.add_argument("--scenario")
-    parser.add_argument(
-        "--overwrite",
-        action="store_true",
-        help="overwrite existing outputs instead of incrementing",
-    )
-    options = parser.parse_args()
-    sclstrhab_task = SCLStructruralHabitat(**vars(options))
-    sclstrhab_task.run()
+    cli.main(SCLStructruralHabitat)
@@ -0,0 +1,342 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import time
+import numpy as np
+import numpy_engine
+import reclass_kernel
+from parameters import DEFAULT_TILE_SIZE
+from profiling import RunProfile
+from raster_io import Window, open_raster
+
+PREVIEW_TILES = 4
+# tiles submitted to the pool ahead of the one being written, per worker
+IN_FLIGHT_PER_WORKER = 2
+NO_PROFILE = RunProfile()
+# inputs on the 30 m grid, `block` pixels per output cell
+FINE_INPUTS = ("forest_height", "watermask")
+
+# Continent-scale local runs stream fixed windows of the output grid through the numpy engine,
+# so peak memory depends on the tile size and not on the range. Forest height (and watermask)
+# windows are the same windows scaled by `block`: every 300 m cell reads its full 10 x 10
+# block of 30 m pixels, which is all the halo the mean aggregation needs on aligned grids.
+
+
+def zone_tile_index(zones, tile_size=DEFAULT_TILE_SIZE):
+    # {window: zone numbers in it} over the tile_size grid, leaving out tiles with no zone. A
+    # zone tile set answers from its index; other rasters are scanned a row of tiles at a time.
+    tile_values = getattr(zones, "tile_values", None)
+    rows, cols = zones.shape
+    index = {}
+    for row_off in range(0, rows, tile_size):
+        height = min(tile_size, rows - row_off)
+        if tile_values is None:
+            strip = zones.read(Window(row_off, 0, height, cols))
+        for col_off in range(0, cols, tile_size):
+            window = Window(row_off, col_off, height, min(tile_size, cols - col_off))
+            if tile_values is not None:
+                present = tile_values(window)
+            else:
+                tile = strip[:, col_off : col_off + window.width]
+                present = [v.item() for v in np.unique(tile[tile != 0])]
+            if present:
+                index[window] = tuple(present)
+    return index
+
+
+def species_tile_index(zones, tile_size=DEFAULT_TILE_SIZE):
+    # {window: {species: zone numbers}} for the windows where any species has a zone
+    index = {}
+    for species, zone_source in zones.items():
+        for window, present in zone_tile_index(zone_source, tile_size).items():
+            index.setdefault(window, {})[species] = present
+    return dict(sorted(index.items()))
+
+
+def tile_windows(bounds, tile_size=DEFAULT_TILE_SIZE):
+    for row_off in range(bounds.row_off, bounds.row_off + bounds.height, tile_size):
+        for col_off in range(bounds.col_off, bounds.col_off + bounds.width, tile_size):
+            yield Window(
+                row_off,
+                col_off,
+                min(tile_size, bounds.row_off + bounds.height - row_off),
+                min(tile_size, bounds.col_off + bounds.width - col_off),
+            )
+
+
+def read_input(name, source, window, block):
+    array = source.read(window.scaled(block) if name in FINE_INPUTS else window)
+    nodata = getattr(source, "nodata", None)
+    if nodata is None or np.issubdtype(array.dtype, np.floating):
+        return array
+    return mask_nodata(name, array, array == nodata)
+
+
+def mask_nodata(name, array, missing):
+    # integer nodata becomes a value every engine excludes, as ee masks it: outside all zones,
+    # a land cover class outside every table, water, or a nan elevation / forest height
+    if not missing.any():
+        return array
+    if name in ("zones", "watermask"):
+        array = array.copy()
+        array[missing] = 0
+    elif name == "land_cover_esa":
+        array = array.astype(np.int16)
+        array[missing] = -1
+    else:
+        array = array.astype(np.float32)
+        array[missing] = np.nan
+    return array
+
+
+def read_tile(sources, window, block, profile=NO_PROFILE):
+    with profile.stage("read_tile") as counts:
+        arrays = {
+            name: None if source is None else read_input(name, source, window, block)
+            for name, source in sources.items()
+        }
+        counts["pixels"] += window.height * window.width
+        counts["bytes_read"] += sum(a.nbytes for a in arrays.values() if a is not None)
+    return arrays
+
+
+def compute_tile(
+    zones,
+    sources,
+    window,
+    block=10,
+    single_pass=False,
+    species=None,
+    profile=NO_PROFILE,
+    sweep=None,
+    lazy=False,
+):
+    # shared inputs are read once per window and evaluated against every species' zones;
+    # species maps the species to evaluate to the zone numbers present, when known. With a
+    # sweep grid each species' tile is a stack with one band per scenario.
+    arrays = read_tile(sources, window, block, profile)
+    str_hab = {}
+    for zone_species, zone_source in zones.items():
+        if species is not None and zone_species not in species:
+            continue
+        with profile.stage("read_zones") as counts:
+            zone_tile = read_input("zones", zone_source, window, block)
+            counts["pixels"] += zone_tile.size
+            counts["bytes_read"] += zone_tile.nbytes
+        if not zone_tile.any():
+            continue
+        if sweep is not None:
+            with profile.stage("sweep") as counts:
+                str_hab[zone_species] = numpy_engine.structural_habitat_sweep(
+                    zone_species,
+                    arrays["land_cover_esa"],
+                    arrays["elevation"],
+                    zone_tile,
+                    sweep,
+                    forest_height=arrays.get("forest_height"),
+                    watermask=arrays.get("watermask"),
+                    block=block,
+                )
+                counts["pixels"] += zone_tile.size
+            continue
+        with profile.stage("landcover_reclass") as counts:
+            if not (single_pass or lazy):
+                # the fused kernel reuses its buffers: its tile is written out before the
+                # next window of this species is computed
+                str_hab[zone_species] = reclass_kernel.kernel(zone_species, block)(
+                    arrays["land_cover_esa"],
+                    arrays["elevation"],
+                    zone_tile,
+                    arrays.get("forest_height"),
+                    arrays.get("watermask"),
+                )
+                counts["pixels"] += zone_tile.size
+                continue
+            str_hab[zone_species] = numpy_engine.structural_habitat(
+                zone_species,
+                arrays["land_cover_esa"],
+                arrays["elevation"],
+                zone_tile,
+                forest_height=arrays.get("forest_height"),
+                watermask=arrays.get("watermask"),
+                block=block,
+                single_pass=single_pass,
+                zone_numbers=species and species[zone_species],
+                lazy=lazy,
+            )
+            counts["pixels"] += zone_tile.size
+    return str_hab
+
+
+# Worker processes open their own (memory-mapped or windowed) readers on the input paths, so
+# only window coordinates go out and finished uint8 tiles come back; input pixels never cross
+# a pipe.
+_worker = {}
+
+
+def _open_paths(paths):
+    return {name: open_raster(path) if path else None for name, path in paths.items()}
+
+
+def _init_worker(zone_paths, paths, block, single_pass, profiled, sweep, lazy):
+    _worker.update(
+        zones=_open_paths(zone_paths),
+        sources=_open_paths(paths),
+        block=block,
+        single_pass=single_pass,
+        profiled=profiled,
+        sweep=sweep,
+        lazy=lazy,
+    )
+
+
+def _compute_worker_tile(item):
+    window, species = item
+    profile = RunProfile(enabled=_worker["profiled"])
+    str_hab = compute_tile(
+        _worker["zones"],
+        _worker["sources"],
+        window,
+        _worker["block"],
+        _worker["single_pass"],
+        species,
+        profile,
+        _worker["sweep"],
+        _worker["lazy"],
+    )
+    return window, str_hab, profile.stages
+
+
+def _compute_in_order(pool, items, in_flight):
+    # worker results in submission order, pulling items from the plan only as tiles finish so
+    # that at most in_flight tiles (and their results) are held at once
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(_compute_worker_tile, item))
+        if len(pending) >= in_flight:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _paths(sources):
+    return {name: s.path if s else None for name, s in sources.items()}
+
+
+def _plan(index, incremental, sinks, profile=NO_PROFILE):
+    # pair each window with the species (and zones) to compute in it, writing reused tiles
+    # straight out
+    for window, species in index.items():
+        if incremental is None:
+            yield window, species
+            continue
+        with profile.stage("plan_incremental") as counts:
+            compute, reused = incremental.plan(window, species, counts)
+            for reused_species, tile in reused.items():
+                sinks[reused_species].write(window, tile)
+        if compute:
+            yield window, {s: species[s] for s in compute}
+
+
+def stream_structural_habitat(
+    zones,
+    sources,
+    sinks,
+    tile_size=DEFAULT_TILE_SIZE,
+    block=10,
+    single_pass=False,
+    workers=1,
+    incremental=None,
+    profile=NO_PROFILE,
+    sweep=None,
+    lazy=False,
+):
+    # zones and sinks are keyed by species; sources holds the inputs all species share. Only
+    # tiles holding a zone are visited, so the work follows the range and not its bounding box.
+    # A sweep grid evaluates its scenarios in the same pass, writing stacked tiles to sinks.
+    with profile.stage("zone_index"):
+        index = species_tile_index(zones, tile_size)
+    items = _plan(index, incremental, sinks, profile)
+    if workers > 1:
+        pool = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(
+                _paths(zones),
+                _paths(sources),
+                block,
+                single_pass,
+                profile.enabled,
+                sweep,
+                lazy,
+            ),
+        )
+        results = _compute_in_order(pool, items, IN_FLIGHT_PER_WORKER * workers)
+    else:
+        pool = None
+        results = (
+            (
+                window,
+                compute_tile(
+                    zones,
+                    sources,
+                    window,
+                    block,
+                    single_pass,
+                    species,
+                    profile,
+                    sweep,
+                    lazy,
+                ),
+                {},
+            )
+            for window, species in items
+        )
+
+    tiles = 0
+    try:
+        for window, str_hab, worker_stages in results:
+            profile.merge(worker_stages)
+            with profile.stage("write") as counts:
+                for species, tile in str_hab.items():
+                    sinks[species].write(window, tile)
+                    counts["pixels"] += tile.size
+            tiles += 1
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    return tiles
+
+
+def preview_structural_habitat(
+    zones,
+    sources,
+    tile_size=DEFAULT_TILE_SIZE,
+    block=10,
+    single_pass=False,
+    lazy=False,
+):
+    # compute a few evenly spaced tiles and extrapolate the cost of the whole run
+    index = species_tile_index(zones, tile_size)
+    if not index:
+        return {"tiles": 0, "pixels": 0}
+    windows = list(index)
+    step = max(1, len(windows) // PREVIEW_TILES)
+    sample = windows[::step][:PREVIEW_TILES]
+
+    start = time.perf_counter()
+    habitat_pixels = {species: 0 for species in zones}
+    for window in sample:
+        for species, tile in compute_tile(
+            zones, sources, window, block, single_pass, index[window], lazy=lazy
+        ).items():
+            habitat_pixels[species] += int(tile.sum())
+    seconds_per_tile = (time.perf_counter() - start) / len(sample)
+
+    return {
+        "tiles": len(windows),
+        "pixels": sum(w.height * w.width for w in windows),
+        "sampled_tiles": len(sample),
+        "sample_habitat_pixels": habitat_pixels,
+        "seconds_per_tile": round(seconds_per_tile, 4),
+        "estimated_seconds": round(seconds_per_tile * len(windows), 1),
+    }
@@ -0,0 +1,194 @@
+import json
+import os
+import numpy as np
+from keyed_cache import KeyedFileCache
+from parameters import BIOME_ZONE_LABEL
+from raster_io import TILESET_EXTENSION, TileSetSource, Window, write_tileset
+from tiling import tile_windows
+
+ZONE_DTYPE = np.uint8
+ZONE_TILE_SIZE = 512
+# nominal metres per degree ee uses to convert a scale to an EPSG:4326 pixel size
+METERS_PER_DEGREE = 111319.49079327357
+
+# Zone polygons rasterised once per species, scale, CRS and grid into a uint8 tile set whose
+# index lists the zone numbers, reused until the zones source (file or ee asset) changes.
+
+
+def zone_features(geojson):
+    # [(geometry, zone)] from a GeoJSON FeatureCollection, skipping features without a zone
+    features = []
+    for feature in geojson["features"]:
+        zone = (feature.get("properties") or {}).get(BIOME_ZONE_LABEL)
+        if zone is None or not feature.get("geometry"):
+            continue
+        if not 0 < int(zone) <= np.iinfo(ZONE_DTYPE).max:
+            raise ValueError(
+                f"{BIOME_ZONE_LABEL} {zone} does not fit a uint8 zone raster"
+            )
+        features.append((feature["geometry"], int(zone)))
+    return features
+
+
+def read_zone_features(path):
+    with open(path) as f:
+        return zone_features(json.load(f))
+
+
+def _rings(geometry):
+    if geometry["type"] == "Polygon":
+        return geometry["coordinates"]
+    if geometry["type"] == "MultiPolygon":
+        return [ring for polygon in geometry["coordinates"] for ring in polygon]
+    if geometry["type"] == "GeometryCollection":
+        return [ring for part in geometry["geometries"] for ring in _rings(part)]
+    return []
+
+
+def _edges(geometry):
+    # (x1, y1, x2, y2) per polygon edge, every ring closed
+    edges = []
+    for ring in _rings(geometry):
+        ring = np.asarray(ring, dtype=np.float64)[:, :2]
+        if len(ring) < 3:
+            continue
+        if not np.array_equal(ring[0], ring[-1]):
+            ring = np.vstack([ring, ring[:1]])
+        edges.append(np.hstack([ring[:-1], ring[1:]]))
+    if not edges:
+        return np.empty((0, 4))
+    return np.vstack(edges)
+
+
+def polygon_mask(edges, transform, window):
+    # pixel-centre, even-odd rasterisation of polygon edges over window of the grid defined
+    # by a north-up transform (a, b, c, d, e, f)
+    a, b, c, d, e, f = transform
+    if b or d:
+        raise ValueError("zone rasterisation needs a north-up grid without rotation")
+    # edge end points in fractional window pixel coordinates, measured from pixel centres
+    cols = (edges[:, [0, 2]] - c) / a - 0.5 - window.col_off
+    rows = (edges[:, [1, 3]] - f) / e - 0.5 - window.row_off
+    row_first = np.clip(np.ceil(rows.min(axis=1)), 0, window.height).astype(np.int64)
+    row_stop = np.clip(np.ceil(rows.max(axis=1)), 0, window.height).astype(np.int64)
+    spans = row_stop - row_first
+    crossing_edges = np.repeat(np.arange(len(edges)), spans)
+    crossing_rows = np.repeat(row_first, spans) + (
+        np.arange(spans.sum()) - np.repeat(np.cumsum(spans) - spans, spans)
+    )
+
+    # every crossing toggles inside/outside for the pixel centres to its right
+    r1, r2 = rows[crossing_edges, 0], rows[crossing_edges, 1]
+    c1, c2 = cols[crossing_edges, 0], cols[crossing_edges, 1]
+    crossing_cols = c1 + (crossing_rows - r1) * (c2 - c1) / (r2 - r1)
+    first_inside = np.clip(np.floor(crossing_cols) + 1, 0, window.width)
+    toggles = np.zeros((window.height, window.width + 1), dtype=np.int32)
+    np.add.at(toggles, (crossing_rows, first_inside.astype(np.int64)), 1)
+    return (np.cumsum(toggles[:, :-1], axis=1) & 1).astype(bool)
+
+
+def _window_bounds(transform, window):
+    a, _, c, _, e, f = transform
+    xs = sorted([c + window.col_off * a, c + (window.col_off + window.width) * a])
+    ys = sorted([f + window.row_off * e, f + (window.row_off + window.height) * e])
+    return xs[0], ys[0], xs[1], ys[1]
+
+
+def zone_edges(features):
+    return [(_edges(geometry), zone) for geometry, zone in features]
+
+
+def rasterize_zones(edges_by_zone, transform, window):
+    # zone number per pixel, 0 outside all zones; where zones overlap the most frequent one
+    # wins, ties going to the lowest zone, as with reduceToImage(mode)
+    x_min, y_min, x_max, y_max = _window_bounds(transform, window)
+    votes = {}
+    for edges, zone in edges_by_zone:
+        if (
+            not len(edges)
+            or edges[:, [0, 2]].max() < x_min
+            or edges[:, [0, 2]].min() > x_max
+            or edges[:, [1, 3]].max() < y_min
+            or edges[:, [1, 3]].min() > y_max
+        ):
+            continue
+        mask = polygon_mask(edges, transform, window)
+        if mask.any():
+            votes.setdefault(zone, np.zeros(mask.shape, dtype=np.uint16))
+            votes[zone] += mask
+    zones = np.zeros((window.height, window.width), dtype=ZONE_DTYPE)
+    if not votes:
+        return zones
+    zone_numbers = sorted(votes)
+    counts = np.stack([votes[zone] for zone in zone_numbers])
+    winner = np.asarray(zone_numbers, dtype=ZONE_DTYPE)[counts.argmax(axis=0)]
+    return np.where(counts.any(axis=0), winner, zones)
+
+
+def features_grid(features, scale, crs):
+    # grid snapped to whole pixels around the features, for runs with no raster to align to
+    if crs != "EPSG:4326":
+        raise ValueError(
+            f"cannot derive a {crs} grid from GeoJSON zones; supply a raster grid"
+        )
+    coordinates = np.vstack([_edges(geometry)[:, :2] for geometry, _ in features])
+    pixel = scale / METERS_PER_DEGREE
+    col_min, row_min = np.floor(coordinates.min(axis=0) / pixel).astype(int)
+    col_max, row_max = np.ceil(coordinates.max(axis=0) / pixel).astype(int)
+    return {
+        "crs": crs,
+        "transform": [pixel, 0.0, col_min * pixel, 0.0, -pixel, row_max * pixel],
+        "shape": [int(row_max - row_min), int(col_max - col_min)],
+    }
+
+
+def raster_grid(source):
+    transform = source.profile["transform"]
+    return {
+        "crs": str(source.profile["crs"]),
+        "transform": [float(v) for v in list(transform)[:6]],
+        "shape": list(source.shape),
+    }
+
+
+class ZoneRasterCache(KeyedFileCache):
+    name = "zones"
+    extension = TILESET_EXTENSION
+
+    @staticmethod
+    def key(species, zones_id, scale, crs, grid=None):
+        # grid None: derive one from the features, which zones_id already pins down
+        return KeyedFileCache.key(
+            species=species, zones_id=zones_id, scale=scale, crs=crs, grid=grid
+        )
+
+    def get(self, key):
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        return TileSetSource(path)
+
+    def put(self, key, fields, features, tile_size=ZONE_TILE_SIZE):
+        # features is a callable so a cache hit never loads or fetches the polygons
+        features = features()
+        grid = fields["grid"] or features_grid(features, fields["scale"], fields["crs"])
+        if grid["crs"] != "EPSG:4326":
+            raise ValueError(
+                f"zone polygons are EPSG:4326 and cannot be rasterised onto {grid['crs']}"
+            )
+        shape = tuple(grid["shape"])
+        edges_by_zone = zone_edges(features)
+        write_tileset(
+            self.path(key),
+            shape,
+            ZONE_DTYPE,
+            tile_size,
+            (
+                (window, rasterize_zones(edges_by_zone, grid["transform"], window))
+                for window in tile_windows(Window(0, 0, *shape), tile_size)
+            ),
+            grid=grid,
+            image_id=key,
+            metadata={**fields, "zones": sorted({zone for _, zone in features})},
+        )
+        return TileSetSource(self.path(key))
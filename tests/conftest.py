@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(
+    0,
+    os.environ.get(
+        "SCL_SRC_DIR",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"),
+    ),
+)
+# compiled lookups go to a throwaway cache rather than the user's
+os.environ.setdefault("SCL_CACHE_DIR", tempfile.mkdtemp(prefix="scl-tests-"))
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+import bitmask
+import raster_io
+import tiling
+
+# neither the width nor the tile size is a multiple of 8, so most windows start and end
+# inside a byte their neighbours share
+SHAPE = (23, 45)
+
+
+@pytest.mark.parametrize("tile_size", [5, 13, 45])
+def test_unaligned_windows_round_trip(tmp_path, tile_size):
+    rng = np.random.default_rng(tile_size)
+    array = (rng.random(SHAPE) > 0.5).astype(np.uint8)
+    valid = rng.random(SHAPE) > 0.1
+    windows = list(tiling.tile_windows(raster_io.Window(0, 0, *SHAPE), tile_size))
+    path = str(tmp_path / "str_hab.bits")
+    # out of order, so every shared byte is merged into after it was first written
+    with bitmask.BitMaskSink(path, SHAPE) as sink:
+        for index in rng.permutation(len(windows)):
+            window = windows[index]
+            rows = slice(window.row_off, window.row_off + window.height)
+            columns = slice(window.col_off, window.col_off + window.width)
+            sink.write(window, array[rows, columns], valid[rows, columns])
+
+    mask = bitmask.read_bitmask(path)
+    np.testing.assert_array_equal(mask.to_array(), array & valid)
+    np.testing.assert_array_equal(mask.valid_mask(), valid)
+    assert mask.count() == np.count_nonzero(array & valid)
+    assert mask.count_valid() == np.count_nonzero(valid)
+    with bitmask.BitMaskSource(path) as source:
+        for window in windows:
+            rows = slice(window.row_off, window.row_off + window.height)
+            columns = slice(window.col_off, window.col_off + window.width)
+            np.testing.assert_array_equal(
+                source.read(window), (array & valid)[rows, columns]
+            )
+
+
+def test_unwritten_windows_stay_invalid(tmp_path):
+    path = str(tmp_path / "str_hab.bits")
+    with bitmask.BitMaskSink(path, SHAPE) as sink:
+        sink.write(raster_io.Window(3, 5, 7, 11), np.ones((7, 11), np.uint8))
+    valid = np.zeros(SHAPE, dtype=bool)
+    valid[3:10, 5:16] = True
+    mask = bitmask.read_bitmask(path)
+    np.testing.assert_array_equal(mask.valid_mask(), valid)
+    np.testing.assert_array_equal(mask.to_array(), valid.astype(np.uint8))
@@ -0,0 +1,86 @@
+import types
+import numpy as np
+import pytest
+import ee_cassette
+
+
+class FakeImage:
+    # just enough of an ee.Image for a cassette: building is local, getInfo is a service call
+    calls = []
+
+    def __init__(self, asset):
+        self.asset = asset
+
+    def select(self, band):
+        return FakeImage(f"{self.asset}/{band}")
+
+    def getInfo(self):
+        FakeImage.calls.append(self.asset)
+        return {"id": self.asset, "version": len(FakeImage.calls)}
+
+
+class FakeEEException(Exception):
+    pass
+
+
+def compute_pixels(request):
+    if request["assetId"] == "missing":
+        raise FakeEEException("Image.load: asset not found")
+    return np.arange(12, dtype=np.int16).reshape(3, 4)
+
+
+def fake_ee():
+    return types.SimpleNamespace(
+        Image=FakeImage,
+        EEException=FakeEEException,
+        data=types.SimpleNamespace(computePixels=compute_pixels),
+    )
+
+
+def session(ee):
+    # the calls a run makes, in order, including a failing one and a repeated one
+    results = [
+        ee.Image("elevation").select("b1").getInfo(),
+        ee.data.computePixels({"assetId": "land_cover"}),
+        ee.Image("elevation").select("b1").getInfo(),
+    ]
+    with pytest.raises(ee.EEException, match="asset not found"):
+        ee.data.computePixels({"assetId": "missing"})
+    return results
+
+
+def replay(path):
+    cassette = ee_cassette.Cassette(path, ee_cassette.REPLAY)
+    return session(ee_cassette.Proxy("ee", None, cassette))
+
+
+def test_replay_returns_the_recorded_responses(tmp_path):
+    FakeImage.calls.clear()
+    cassette = ee_cassette.Cassette(str(tmp_path), ee_cassette.RECORD, fake_ee())
+    recorded = session(ee_cassette.Proxy("ee", fake_ee(), cassette))
+    cassette.close()
+    assert len(FakeImage.calls) == 2
+
+    for _ in range(2):
+        replayed = replay(str(tmp_path))
+        assert len(FakeImage.calls) == 2
+        # repeated calls come back in recorded order, arrays from their blobs
+        assert replayed[0] == recorded[0] and replayed[2] == recorded[2]
+        assert replayed[0] != replayed[2]
+        np.testing.assert_array_equal(replayed[1], recorded[1])
+        assert replayed[1].dtype == recorded[1].dtype
+
+
+def test_replay_misses_unrecorded_calls(tmp_path):
+    cassette = ee_cassette.Cassette(str(tmp_path), ee_cassette.RECORD, fake_ee())
+    ee_cassette.Proxy("ee", fake_ee(), cassette).Image("elevation").getInfo()
+    cassette.close()
+
+    ee = ee_cassette.Proxy(
+        "ee", None, ee_cassette.Cassette(str(tmp_path), ee_cassette.REPLAY)
+    )
+    ee.Image("elevation").getInfo()
+    with pytest.raises(ee_cassette.CassetteMiss):
+        ee.Image("elevation").getInfo()
+    with pytest.raises(ee_cassette.CassetteMiss):
+        ee.Image("land_cover").getInfo()
@@ -0,0 +1,36 @@
+import exports
+
+SPLITS = 3
+
+
+def test_split_exports_retry_only_the_failed_strip():
+    # strips submitted at the same time from several threads each get their own task, and
+    # only the strip failing its first attempt is resubmitted
+    names = [
+        f"Panthera_tigris/structural_habitat_{i + 1}of{SPLITS}" for i in range(SPLITS)
+    ]
+    service = exports.LocalExportService(
+        dict.fromkeys(names, 0.2), fail_first=names[:1], submit_seconds=0.05
+    )
+    discarded = []
+    jobs = [
+        exports.ExportJob(name, service.submitter(name), discarded.append)
+        for name in names
+    ]
+    progress = exports.ExportProgress(names, verbose=False)
+    task_ids = exports.export_all(
+        jobs,
+        service.status,
+        progress=progress,
+        poll_seconds=0.05,
+        max_poll_seconds=0.1,
+        retries=1,
+    )
+
+    assert len(service.tasks) == SPLITS + 1
+    assert all(task_ids[name].startswith(f"{name}-") for name in names)
+    assert len(discarded) == 1 and discarded[0].startswith(f"{names[0]}-")
+    assert task_ids[names[0]] != discarded[0]
+    assert {state for state, _, _ in progress.states.values()} == {"COMPLETED"}
+    assert progress.states[names[0]][2] == 2
+    assert all(progress.states[name][2] == 1 for name in names[1:])
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+import numpy_engine
+import reclass_kernel
+from lookup import load_lookup
+from parameters import HEIGHT
+
+SPECIES = "Panthera_tigris"
+BLOCK = 2
+ZONE = 1
+
+
+@pytest.fixture
+def tiger():
+    # a 2 x 3 tile in one zone, all below every elevation ceiling: column 0 holds a class
+    # that requires forest height, column 1 one that does not, column 2 one tigers never use.
+    # Row 0 cells have full tall forest cover, row 1 cells none.
+    reclass_lookup = load_lookup(SPECIES)
+    height_class = int(np.flatnonzero(reclass_lookup.requires_height)[0])
+    plain_class = int(
+        np.flatnonzero(reclass_lookup.include_class & ~reclass_lookup.include_height)[0]
+    )
+    excluded_class = int(np.flatnonzero(~reclass_lookup.include_class)[0])
+    land_cover = np.array([[height_class, plain_class, excluded_class]] * 2, np.uint8)
+    elevation = np.zeros(land_cover.shape, np.int16)
+    zones = np.full(land_cover.shape, ZONE, np.uint8)
+    threshold = HEIGHT[SPECIES]["HEIGHT_THRESHOLD"]
+    forest_height = np.zeros((2 * BLOCK, 3 * BLOCK), np.float32)
+    forest_height[:BLOCK] = threshold + 1
+    forest_height[BLOCK:] = threshold - 1
+    expected = np.array([[1, 1, 0], [0, 1, 0]], np.uint8)
+    return land_cover, elevation, zones, forest_height, expected
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {},
+        {"single_pass": True},
+        {"lazy": True},
+        {"lazy": True, "single_pass": True},
+    ],
+    ids=["eager", "single_pass", "lazy", "lazy_single_pass"],
+)
+def test_structural_habitat_gates_height_classes(tiger, options):
+    land_cover, elevation, zones, forest_height, expected = tiger
+    str_hab = numpy_engine.structural_habitat(
+        SPECIES, land_cover, elevation, zones, forest_height, block=BLOCK, **options
+    )
+    np.testing.assert_array_equal(str_hab, expected)
+
+
+@pytest.mark.parametrize("jit", [False, True], ids=["numpy", "loop"])
+def test_reclass_kernel_gates_height_classes(tiger, jit):
+    land_cover, elevation, zones, forest_height, expected = tiger
+    kernel = reclass_kernel.ReclassKernel(
+        SPECIES, block=BLOCK, jit=jit, workspace=reclass_kernel.Workspace()
+    )
+    np.testing.assert_array_equal(
+        kernel(land_cover, elevation, zones, forest_height), expected
+    )
+
+
+def test_height_classes_need_cover_at_threshold(tiger):
+    # exactly HEIGHT_COVER_THRESHOLD percent tall pixels is enough
+    land_cover, elevation, zones, _, expected = tiger
+    threshold = HEIGHT[SPECIES]["HEIGHT_THRESHOLD"]
+    cover = HEIGHT[SPECIES]["HEIGHT_COVER_THRESHOLD"]
+    tall = BLOCK * BLOCK * cover // 100
+    cell = np.where(np.arange(BLOCK * BLOCK) < tall, threshold, 0.0).reshape(
+        BLOCK, BLOCK
+    )
+    forest_height = np.tile(cell, (2, 3)).astype(np.float32)
+    forest_height[BLOCK:] = 0
+    str_hab = numpy_engine.structural_habitat(
+        SPECIES, land_cover, elevation, zones, forest_height, block=BLOCK
+    )
+    np.testing.assert_array_equal(str_hab, expected)
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+import raster_io
+import tiling
+from lookup import load_lookup
+
+SPECIES = "Panthera_tigris"
+SHAPE = (4, 6)
+BLOCK = 2
+ELEVATION_NODATA = -32768
+# valid values elsewhere, so a nodata cell read as data would be habitat
+ZONES_NODATA = 2
+
+
+@pytest.fixture
+def sources(tmp_path):
+    # every cell is habitat but for one cell of each input set to its GeoTIFF nodata value
+    reclass_lookup = load_lookup(SPECIES)
+    plain_classes = np.flatnonzero(
+        reclass_lookup.include_class & ~reclass_lookup.include_height
+    )
+    land_cover = np.full(SHAPE, plain_classes[0], np.uint8)
+    land_cover[0, 0] = plain_classes[1]
+    elevation = np.zeros(SHAPE, np.int16)
+    elevation[1, 1] = ELEVATION_NODATA
+    zones = np.ones(SHAPE, np.uint8)
+    zones[2, 2] = ZONES_NODATA
+    profile = {
+        "crs": "EPSG:4326",
+        "transform": raster_io._rasterio().Affine(0.0027, 0, 0, 0, -0.0027, 0),
+    }
+    opened = {}
+    for name, array, nodata in (
+        ("land_cover_esa", land_cover, plain_classes[1]),
+        ("elevation", elevation, ELEVATION_NODATA),
+        ("zones", zones, ZONES_NODATA),
+    ):
+        path = str(tmp_path / f"{name}.tif")
+        with raster_io.RasterSink(path, SHAPE, array.dtype, profile, nodata) as sink:
+            sink.write(raster_io.Window(0, 0, *SHAPE), array)
+        opened[name] = raster_io.RasterSource(path)
+    path = str(tmp_path / "forest_height.npy")
+    np.save(path, np.full((SHAPE[0] * BLOCK, SHAPE[1] * BLOCK), 20, np.float32))
+    opened["forest_height"] = raster_io.RasterSource(path)
+    yield opened
+    for source in opened.values():
+        source.close()
+
+
+@pytest.mark.parametrize(
+    "options",
+    [{}, {"single_pass": True}, {"lazy": True}],
+    ids=["kernel", "single_pass", "lazy"],
+)
+def test_integer_nodata_is_never_habitat(sources, options):
+    zones = {SPECIES: sources.pop("zones")}
+    str_hab = tiling.compute_tile(
+        zones, sources, raster_io.Window(0, 0, *SHAPE), BLOCK, **options
+    )[SPECIES]
+    expected = np.ones(SHAPE, np.uint8)
+    expected[0, 0] = expected[1, 1] = expected[2, 2] = 0
+    np.testing.assert_array_equal(str_hab, expected)
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+import numpy_engine
+from lookup import load_lookup
+from parameters import SPECIES, ZONE_KEY_MULTIPLIER
+
+BLOCK = 4
+
+
+@pytest.fixture(scope="module")
+def tile():
+    # random inputs over every lc_value, the full elevation range and one zone past the last
+    rng = np.random.default_rng(0)
+    shape = (40, 50)
+    land_cover = rng.integers(0, 256, size=shape).astype(np.uint8)
+    elevation = rng.integers(-50, 6000, size=shape).astype(np.int16)
+    zone_count = max(len(load_lookup(species).zone_numbers) for species in SPECIES)
+    zones = rng.integers(0, zone_count + 2, size=shape).astype(np.uint8)
+    fine = (shape[0] * BLOCK, shape[1] * BLOCK)
+    forest_height = rng.uniform(0, 12, size=fine).astype(np.float32)
+    forest_height[rng.random(fine) < 0.05] = np.nan
+    watermask = (rng.random(fine) > 0.05).astype(np.uint8)
+    return land_cover, elevation, zones, forest_height, watermask
+
+
+@pytest.mark.parametrize("species", SPECIES)
+def test_single_pass_matches_per_zone(tile, species):
+    per_zone = numpy_engine.structural_habitat(species, *tile, block=BLOCK)
+    single_pass = numpy_engine.structural_habitat(
+        species, *tile, block=BLOCK, single_pass=True
+    )
+    assert per_zone.any()
+    np.testing.assert_array_equal(single_pass, per_zone)
+
+
+def test_zone_keys_reject_lc_values_past_the_multiplier():
+    # single-pass keys (ee and lazy graph) would alias the next zone's
+    reclass_lookup = load_lookup("Panthera_tigris")
+    include_class = np.zeros(ZONE_KEY_MULTIPLIER + 1, dtype=bool)
+    include_class[ZONE_KEY_MULTIPLIER] = True
+    elev_threshold = np.zeros((2, ZONE_KEY_MULTIPLIER + 1), dtype=np.float32)
+    wide = reclass_lookup._replace(
+        include_class=include_class,
+        include_height=np.zeros_like(include_class),
+        elev_threshold=elev_threshold,
+    )
+    with pytest.raises(ValueError, match="does not fit a zone lookup key"):
+        wide.zone_keys()
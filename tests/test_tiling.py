@@ -0,0 +1,163 @@
+import os
+import numpy as np
+import pytest
+import manifest
+import numpy_engine
+import raster_io
+import tiling
+from lookup import load_lookup, parameter_hash
+from parameters import SPECIES
+
+BLOCK = 4
+SHAPE = (40, 56)
+TILE_SIZE = 16
+INPUTS = ["land_cover_esa", "elevation", "forest_height", "watermask"]
+
+
+@pytest.fixture
+def input_dir(tmp_path):
+    # shared inputs and one zone raster per species, as .npy files
+    rng = np.random.default_rng(0)
+    fine = (SHAPE[0] * BLOCK, SHAPE[1] * BLOCK)
+    forest_height = rng.uniform(0, 12, size=fine).astype(np.float32)
+    forest_height[rng.random(fine) < 0.05] = np.nan
+    arrays = {
+        "land_cover_esa": rng.integers(0, 256, size=SHAPE).astype(np.uint8),
+        "elevation": rng.integers(-50, 6000, size=SHAPE).astype(np.int16),
+        "forest_height": forest_height,
+        "watermask": (rng.random(fine) > 0.05).astype(np.uint8),
+    }
+    for species in SPECIES:
+        zone_count = len(load_lookup(species).zone_numbers)
+        zones = rng.integers(0, zone_count + 1, size=SHAPE).astype(np.uint8)
+        # leave a tile without any zone, which streaming skips
+        zones[:TILE_SIZE, :TILE_SIZE] = 0
+        arrays[f"{species}_zones"] = zones
+    for name, array in arrays.items():
+        np.save(tmp_path / f"{name}.npy", array)
+    return tmp_path
+
+
+def load(input_dir, name):
+    return np.load(input_dir / f"{name}.npy")
+
+
+def expected(input_dir, species):
+    return numpy_engine.structural_habitat(
+        species,
+        load(input_dir, "land_cover_esa"),
+        load(input_dir, "elevation"),
+        load(input_dir, f"{species}_zones"),
+        load(input_dir, "forest_height"),
+        load(input_dir, "watermask"),
+        block=BLOCK,
+    ).astype(np.uint8)
+
+
+def stream(input_dir, output_dir, image_ids=None, previous_dir=None, **options):
+    # runs the tiled engine over input_dir like SCLStructruralHabitat.calc_numpy, and returns
+    # the outputs and the tiles reused from previous_dir
+    image_ids = image_ids or {}
+    os.makedirs(output_dir, exist_ok=True)
+    sources = {
+        name: raster_io.RasterSource(
+            str(input_dir / f"{name}.npy"), image_ids.get(name, name)
+        )
+        for name in INPUTS
+    }
+    zones = {
+        species: raster_io.RasterSource(
+            str(input_dir / f"{species}_zones.npy"), f"{species}_zones"
+        )
+        for species in SPECIES
+    }
+    output_paths = {species: str(output_dir / f"{species}.npy") for species in SPECIES}
+    previous_outputs = {}
+    if previous_dir is not None:
+        previous_outputs = {
+            species: str(previous_dir / f"{species}.npy") for species in SPECIES
+        }
+    incremental = manifest.IncrementalRun(
+        zones,
+        sources,
+        {
+            species: {"lookup": parameter_hash(species), "block": BLOCK}
+            for species in SPECIES
+        },
+        previous_outputs,
+        block=BLOCK,
+    )
+    sinks = {
+        species: raster_io.open_sink(path, SHAPE, np.uint8)
+        for species, path in output_paths.items()
+    }
+    try:
+        tiling.stream_structural_habitat(
+            zones,
+            sources,
+            sinks,
+            tile_size=TILE_SIZE,
+            block=BLOCK,
+            incremental=incremental,
+            **options,
+        )
+    finally:
+        for source in list(sources.values()) + list(zones.values()):
+            source.close()
+        for sink in sinks.values():
+            sink.close()
+        incremental.close()
+    incremental.save(output_paths)
+    outputs = {species: np.load(path) for species, path in output_paths.items()}
+    return outputs, incremental.reused
+
+
+def test_workers_match_one_process(input_dir, tmp_path):
+    serial, _ = stream(input_dir, tmp_path / "serial")
+    parallel, _ = stream(input_dir, tmp_path / "parallel", workers=2)
+    for species in SPECIES:
+        np.testing.assert_array_equal(parallel[species], serial[species])
+        np.testing.assert_array_equal(serial[species], expected(input_dir, species))
+
+
+def test_incremental_rerun_matches_full_recompute(input_dir, tmp_path):
+    _, computed = stream(input_dir, tmp_path / "full")
+    outputs, reused = stream(
+        input_dir, tmp_path / "same", previous_dir=tmp_path / "full"
+    )
+    # unchanged image ids: every tile holding a zone comes from the previous output
+    species_tiles = {
+        species: {
+            (row // TILE_SIZE, col // TILE_SIZE)
+            for row, col in zip(*np.nonzero(load(input_dir, f"{species}_zones")))
+        }
+        for species in SPECIES
+    }
+    assert computed == 0
+    assert reused == sum(len(tiles) for tiles in species_tiles.values())
+    for species in SPECIES:
+        np.testing.assert_array_equal(outputs[species], expected(input_dir, species))
+
+    # a new land cover image id: its windows are digested and compared, which the first
+    # change cannot match (no digests recorded yet) but the second can
+    previous_dir = tmp_path / "same"
+    for run, (row, col) in enumerate([(20, 20), (35, 50)]):
+        land_cover = load(input_dir, "land_cover_esa")
+        land_cover[row, col] = 11 if land_cover[row, col] != 11 else 12
+        np.save(input_dir / "land_cover_esa.npy", land_cover)
+        output_dir = tmp_path / f"changed{run}"
+        outputs, reused = stream(
+            input_dir,
+            output_dir,
+            {"land_cover_esa": f"land_cover_esa-{run}"},
+            previous_dir,
+        )
+        for species in SPECIES:
+            np.testing.assert_array_equal(
+                outputs[species], expected(input_dir, species)
+            )
+        previous_dir = output_dir
+    changed_tile = (35 // TILE_SIZE, 50 // TILE_SIZE)
+    assert reused == sum(
+        len(tiles - {changed_tile}) for tiles in species_tiles.values()
+    )